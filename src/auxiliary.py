@@ -2,8 +2,12 @@
 """Auxiliary Functions
 """
 
+import os
+import json
 import time
 from collections import defaultdict
+from bisect import bisect_left
+from weakref import WeakKeyDictionary
 
 #####
 # PRINTING
@@ -26,25 +30,126 @@ def color_format(text,color):
     """
     return "{}{}{}".format(getattr(bcolors,color),text,bcolors.ENDC)
 
+class Progress:
+    """Progress reporting with verbosity levels
+    SILENT prints nothing, NORMAL prints messages and at most RATE status
+    lines per second, VERBOSE prints every status line.
+    Default level comes from the environment variable CHARM_VERBOSITY
+    """
+    SILENT, NORMAL, VERBOSE = 0, 1, 2
+    level = int(os.environ.get('CHARM_VERBOSITY',NORMAL))
+    RATE = 10     # status lines per second (NORMAL)
+    last = 0.0    # time of last status line
+
+    def message(*args,level=NORMAL,**kw):
+        """print if verbosity is at least level
+        """
+        if Progress.level >= level:
+            print(*args,**kw)
+
+    def due():
+        """Returns True if a status line should be printed now
+        Callers check this before formatting the line
+        """
+        if Progress.level >= Progress.VERBOSE:
+            return True
+        if Progress.level < Progress.NORMAL:
+            return False
+        now = time.time()
+        if now - Progress.last < 1 / Progress.RATE:
+            return False
+        Progress.last = now
+        return True
+
 #####
 # TIMING
 
 class Timer:
-    times = defaultdict(float)
-    
+    """Hierarchical profiler
+    Records calls, inclusive and exclusive time of each call path (tuple of
+    function names from the outermost timed call). Disabled by setting the
+    environment variable CHARM_PROFILE=0 before import, in which case
+    timeit returns functions undecorated.
+    """
+    enabled = os.environ.get('CHARM_PROFILE','1') != '0'
+    paths = defaultdict(lambda: [0,0.0,0.0]) # path -> calls, incl, excl
+    stack = [] # [path, time spent in timed children] of active calls
+
     def timeit(f):
+        if not Timer.enabled:
+            return f
+        name = f.__name__
         def timed(*args, **kw):
-            ts = time.time()
-            result = f(*args, **kw)
-            te = time.time()
-            Timer.times[f.__name__] += (te - ts)
-            return result
+            stack = Timer.stack
+            path = stack[-1][0] + (name,) if stack else (name,)
+            frame = [path,0.0]
+            stack.append(frame)
+            ts = time.perf_counter()
+            try:
+                return f(*args, **kw)
+            finally:
+                elapsed = time.perf_counter() - ts
+                stack.pop()
+                stats = Timer.paths[path]
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] += elapsed - frame[1]
+                if stack:
+                    stack[-1][1] += elapsed
+        timed.__name__ = name
+        timed.__doc__ = f.__doc__
         return timed
 
+    def functions():
+        """Returns dict of function name -> (calls, inclusive, exclusive)
+        Inclusive time of recursive calls is only counted at the outermost
+        """
+        totals = defaultdict(lambda: [0,0.0,0.0])
+        for path,(calls,incl,excl) in Timer.paths.items():
+            total = totals[path[-1]]
+            total[0] += calls
+            total[2] += excl
+            if path[-1] not in path[:-1]:
+                total[1] += incl
+        return {name: tuple(t) for name,t in totals.items()}
+
+    def reset():
+        Timer.paths.clear()
+        del Timer.stack[:]
+
     def print_times():
+        """Print per function table (nothing when Progress is SILENT)
+        """
+        if Progress.level < Progress.NORMAL: return
         print(color_format("\nTIMES",'HEADER'))
-        for func,time in Timer.times.items():
-            print("   {}\t{:2f}s".format(func,time))
+        print("   {:<24}{:>10}{:>12}{:>12}".
+              format("function","calls","incl (s)","excl (s)"))
+        functions = Timer.functions()
+        for func in sorted(functions,key=lambda f: -functions[f][1]):
+            calls,incl,excl = functions[func]
+            print("   {:<24}{:>10}{:>12.3f}{:>12.3f}".
+                  format(func,calls,incl,excl))
+
+    def export_json(filename):
+        """Write per function and per path statistics as JSON
+        """
+        data = {
+            'functions': {name: {'calls': c,'inclusive': i,'exclusive': e}
+                          for name,(c,i,e) in Timer.functions().items()},
+            'paths': [{'path': list(path),'calls': c,
+                       'inclusive': i,'exclusive': e}
+                      for path,(c,i,e) in Timer.paths.items()]
+        }
+        with open(filename,'w') as f:
+            json.dump(data,f,indent=2)
+
+    def export_collapsed(filename):
+        """Write collapsed stacks (exclusive microseconds per path) for
+        flamegraph.pl / speedscope
+        """
+        with open(filename,'w') as f:
+            for path,(calls,incl,excl) in sorted(Timer.paths.items()):
+                f.write("{} {}\n".format(";".join(path),int(excl * 1e6)))
 
 #####
 # OPTIMIZATION
@@ -52,7 +157,7 @@ class Timer:
 def memoize(f):
     memo = {}
     def helper(x,y):
-        if x not in memo:
+        if (x,y) not in memo:
             memo[(x,y)] = f(x,y)
         return memo[(x,y)]
     return helper
@@ -66,18 +171,84 @@ def manhattan_distance(point1,point2):
     """
     return abs(point1[0] - point2[0]) + abs(point1[1] - point2[1])
 
-@memoize
 def manhattan_components(cp1,cp2):
     """Given two components, return shortest manhattan distance between
     the two components.
     """
-    min_dist = None
-    for p1 in cp1.line:
-        for p2 in cp2.line:
-            dist = manhattan_distance(p1,p2)
-            if min_dist is None or dist < min_dist:
-                min_dist = dist
-    return min_dist
+    return ComponentDistance.get(cp1,cp2)
+
+class ComponentDistance:
+    """Cached shortest manhattan distance between components
+    Each component's line is reduced to its (x,y) points sorted by x with a
+    bounding box. A query scans outwards in x from each point of the
+    smaller component and stops once the x gap alone is no better than
+    the best found, or the bounding box lower bound is reached.
+    Entries are keyed on the components and dropped when their version
+    (bumped by Component whenever line changes) moves on.
+    """
+    shapes = WeakKeyDictionary()    # component -> (version, points, bbox)
+    distances = WeakKeyDictionary() # cp1 -> {cp2: (v1, v2, distance)}
+
+    def get(cp1,cp2):
+        """Returns shortest manhattan distance between cp1 and cp2
+        (None if either is empty)
+        """
+        cached = ComponentDistance.distances.get(cp1,{}).get(cp2)
+        if cached is not None and cached[:2] == (cp1.version,cp2.version):
+            return cached[2]
+        dist = ComponentDistance.compute(cp1,cp2)
+        if cp1 not in ComponentDistance.distances:
+            ComponentDistance.distances[cp1] = WeakKeyDictionary()
+        ComponentDistance.distances[cp1][cp2] = (cp1.version,cp2.version,
+                                                 dist)
+        return dist
+
+    def shape(cp):
+        """Returns (x,y) points of cp sorted by x and its bounding box
+        """
+        cached = ComponentDistance.shapes.get(cp)
+        if cached is not None and cached[0] == cp.version:
+            return cached[1], cached[2]
+        points = sorted(set((p[0],p[1]) for p in cp.line))
+        bbox = None
+        if len(points) > 0:
+            ys = [p[1] for p in points]
+            bbox = (points[0][0],min(ys),points[-1][0],max(ys))
+        ComponentDistance.shapes[cp] = (cp.version,points,bbox)
+        return points, bbox
+
+    def compute(cp1,cp2):
+        """Returns exact shortest manhattan distance between cp1 and cp2
+        """
+        points1, bbox1 = ComponentDistance.shape(cp1)
+        points2, bbox2 = ComponentDistance.shape(cp2)
+        if bbox1 is None or bbox2 is None:
+            return None
+        if len(points1) > len(points2):
+            points1, points2 = points2, points1
+
+        # bounding boxes give a lower bound
+        bound = (max(bbox1[0] - bbox2[2],bbox2[0] - bbox1[2],0) +
+                 max(bbox1[1] - bbox2[3],bbox2[1] - bbox1[3],0))
+
+        xs = [p[0] for p in points2]
+        best = manhattan_distance(points1[0],points2[0])
+        for x,y in points1:
+            i = bisect_left(xs,x)
+            # scan right then left while the x gap can still improve
+            for j in range(i,len(points2)):
+                qx, qy = points2[j]
+                if qx - x >= best: break
+                dist = qx - x + abs(qy - y)
+                if dist < best: best = dist
+            for j in range(i - 1,-1,-1):
+                qx, qy = points2[j]
+                if x - qx >= best: break
+                dist = x - qx + abs(qy - y)
+                if dist < best: best = dist
+            if best == bound:
+                break
+        return best
 
 def get_dir(A,B):
     """Given waypoints A and B
@@ -21,6 +21,8 @@ __status__ = "pre-alpha"
 
 def pipeline(inputs):    
     # inputs = interface.load_inputs(sys.argv)
+    if 'verbosity' in inputs: # 0 silent, 1 normal, 2 verbose
+        aux.Progress.level = inputs['verbosity']
 
 
 
@@ -30,9 +32,12 @@ def pipeline(inputs):
         controller.lafrieda(layout,inputs)
     except KeyboardInterrupt:
         inputs['output'] = 'interrupted-' + inputs['output']
-        print(aux.color_format(
+        aux.Progress.message(aux.color_format(
             "\n\nKeyboard interrupt. Output current layout to {}".
             format(inputs['output']),
             'HEADER'))
     layout.emit_tcl(inputs['output'])
     aux.Timer.print_times()
+    if 'profile' in inputs: # e.g. 'profile': 'run' -> run.json, run.folded
+        aux.Timer.export_json(inputs['profile'] + '.json')
+        aux.Timer.export_collapsed(inputs['profile'] + '.folded')
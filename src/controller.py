@@ -8,19 +8,34 @@ import ordering
 import auxiliary as aux
 import design_rule_checker as drc
 import data_structures as ds
+import telemetry
 
 import time
+import io
+import contextlib
+import multiprocessing
+import queue
+
+# print through verbosity levels (see aux.Progress)
+report = aux.Progress.message
+
+# snapshot read by forked workers (set before pool is created)
+SNAPSHOT = None
+# after the first portfolio route, wait for a cheaper one for this fraction
+# of the time the first took (0: first result wins)
+PORTFOLIO_WAIT = 0
+PORTFOLIO_POLL = 0.1 # seconds between checks for portfolio workers that died
 
     
 @aux.Timer.timeit
 def naive(layout,inputs):
-    print(aux.color_format("NAIVE CONTROLLER",'HEADER'))
+    report(aux.color_format("NAIVE CONTROLLER",'HEADER'))
 
     # Get parameters
     route_modes = inputs['route_modes']
     
-    # initialize drc cache
-    drc_cache = drc.Cache()
+    # drc cache (kept up to date by layout)
+    drc_cache = layout.drc_cache
     
     # order nets
     nets = ordering.net_rule3(layout)
@@ -35,29 +50,58 @@ def naive(layout,inputs):
                                drc_cache,mode=route_modes)
             if route:
                 # remove old components and create new component
-                layout.components[net].remove(pair[0])
-                layout.components[net].remove(pair[1])
+                layout.remove_component(pair[0])
+                layout.remove_component(pair[1])
                 new_component = ds.Component.join(pair[0],pair[1],route)
-                layout.components[net].append(new_component)
+                layout.add_component(new_component)
             else:
-                print()
+                report()
 
             pair = ordering.closest_first(layout.components[net],checked_pairs)
 
 @aux.Timer.timeit
 def lafrieda(layout,inputs):
     """Ordering based on Lafrieda MS thesis. DFS.
+    Returns summary of the run (routed, total, ripups, cost, time)
     """
 
     def print_status():
-        print("{}/{} routed | {} ripups | Time elapsed {:.2f}s".
-              format(n_success,total_pairs,n_ripups,time.time() - start_time))
+        report("{}/{} routed | {} ripups | Time elapsed {:.2f}s".
+               format(n_success,total_pairs,n_ripups,time.time() - start_time))
+
+    def add_component(component):
+        layout.add_component(component)
+        if incremental: # only the queue needs the changes
+            changes.append((True,component))
+
+    def remove_component(component):
+        layout.remove_component(component)
+        if incremental:
+            changes.append((False,component))
+
+    def reorder():
+        """Returns route queue brought up to date with the layout"""
+        if not incremental:
+            return order_pairs(layout,ordering_cache)
+        for added,component in changes:
+            if added:
+                route_queue.add_component(component)
+            else:
+                route_queue.remove_component(component)
+        changes.clear()
+        return route_queue
     
-    print(aux.color_format("LAFRIEDA CONTROLLER",'HEADER'))
+    report(aux.color_format("LAFRIEDA CONTROLLER",'HEADER'))
 
     # Get parameters
     order_pairs = getattr(ordering,inputs['order'])
     route_modes = inputs['route_modes']
+    workers = inputs.get('workers',1)
+    portfolio = inputs.get('portfolio',False)
+    portfolio_wait = inputs.get('portfolio_wait',PORTFOLIO_WAIT)
+    pair_log = telemetry.PairLog(inputs.get('telemetry'))
+    if 'verbosity' in inputs:
+        aux.Progress.level = inputs['verbosity']
     
     # initialize drc cache
     drc_cache = layout.drc_cache
@@ -65,34 +109,67 @@ def lafrieda(layout,inputs):
     ordering_cache = {}
     
     route_stack, route_index = [], 0
-    route_queue = order_pairs(layout,ordering_cache)
+    # pair_rule3 can be kept up to date instead of re-sorted
+    incremental, changes = inputs['order'] == 'pair_rule3', []
+    if incremental:
+        route_queue = ordering.PairQueue(layout,ordering_cache)
+    else:
+        route_queue = order_pairs(layout,ordering_cache)
     routed_nets, tried_pairs, n_success = [], [], 0
     n_ripups, total_pairs = 0, get_total_routes(layout)
     start_time = time.time()
 
+    # routes found in parallel, and rects added since they were found
+    prefetched, added_rects = {}, []
+
     while route_index < len(route_queue):
         print_status()
         
         pair = route_queue[route_index] # get pair
         net = pair[0].label             # get net
 
-        # try to route
-        route = route_pair(pair[0],pair[1],layout,drc_cache,mode=route_modes)
+        pair_log.start(drc_cache)
+
+        # route independent pairs ahead of time
+        key = frozenset(pair)
+        if workers > 1 and key not in prefetched:
+            prefetched = prefetch_routes(route_queue[route_index:],layout,
+                                         route_modes,workers)
+            added_rects = []
+
+        # try to route. Only a prefetched route still clear of routes added
+        # since is used: a prefetched failure may just be a worker timing
+        # out (TIMEOUT is wall clock), so the pair is routed again here
+        route = prefetched.pop(key,None)
+        was_prefetched = bool(route) and still_valid(route,added_rects)
+        if not was_prefetched:
+            route = route_pair(pair[0],pair[1],layout,drc_cache,
+                               mode=route_modes,portfolio=portfolio,
+                               portfolio_wait=portfolio_wait)
+        else:
+            report(aux.color_format("Prefetched net {}".format(net),'OKBLUE'))
+        attempt = {'net': net,'router': getattr(route,'router',None),
+                   'success': bool(route),'prefetched': was_prefetched,
+                   'ripups': 0}
 
         # successful route
         if route:
             # remove old components and create new component
-            layout.components[net].remove(pair[0])
-            layout.components[net].remove(pair[1])
+            remove_component(pair[0])
+            remove_component(pair[1])
             new_component = ds.Component.join(pair[0],pair[1],route)
-            layout.add_component(new_component)
-            # layout.components[net].append(new_component)
+            add_component(new_component)
+            added_rects += [rect for seg,rect in new_component.seg_rects.items()
+                            if seg not in pair[0].seg_rects and
+                            seg not in pair[1].seg_rects]
 
             # add component to stack
-            route_stack.append((new_component,pair[0],pair[1],route_index))
-            route_queue = order_pairs(layout,ordering_cache)
+            route_stack.append((new_component,pair[0],pair[1],route_index,
+                                route))
+            route_queue = reorder()
             route_index = 0
             n_success += 1
+            pair_log.record(drc_cache,**attempt)
 
         # unsuccessful route
         else:
@@ -106,71 +183,219 @@ def lafrieda(layout,inputs):
                     route_index += 1
                     break
             if both_in:
-                print(aux.color_format("...but there's hope","WARNING"))
+                report(aux.color_format("...but there's hope","WARNING"))
+                pair_log.record(drc_cache,**attempt)
                 continue
 
             # Last occurence of at least one component, so rip up
             first_time = True
-            print()
+            report()
             while (len(route_stack) > 0 and
                    (first_time or route_index + 1 >= len(route_queue))):
                 first_time = False
                 last = route_stack.pop()
                 old_net = last[0].label
-                print(aux.color_format("     ripping up {}".format(old_net),
-                                       "FAIL"))
+                report(aux.color_format("     ripping up {}".format(old_net),
+                                        "FAIL"))
                 n_ripups += 1
                 n_success -= 1
+                attempt['ripups'] += 1
 
-                layout.remove_component(last[0])
-                layout.add_component(last[1])
-                layout.add_component(last[2])
+                remove_component(last[0])
+                add_component(last[1])
+                add_component(last[2])
                 route_index = last[3] + 1
-            route_queue = order_pairs(layout,ordering_cache)
+                prefetched = {}
+            route_queue = reorder()
+            pair_log.record(drc_cache,**attempt)
                 
-    print(aux.color_format("\nDONE! ","OKGREEN"),end="")
+    report(aux.color_format("\nDONE! ","OKGREEN"),end="")
     print_status()
-    print()
+    report(drc_cache.summary())
+    report()
+    pair_log.close()
+
+    return {'routed': n_success,'total': total_pairs,'ripups': n_ripups,
+            'cost': sum(entry[4].cost for entry in route_stack),
+            'time': time.time() - start_time}
 
 
 #################
 # PRIVATE FUNCTIONS
 
-def route_pair(cp1,cp2,layout,drc_cache,mode="l"):
+def route_pair(cp1,cp2,layout,drc_cache,mode="l",portfolio=False,
+               portfolio_wait=PORTFOLIO_WAIT):
     """Given two components, return shortest route if possible, else False
     Mode determines method used. Current options are (l)ee and (p)attern
+    If portfolio, run the routers concurrently instead of in turn
+    (see route_portfolio for portfolio_wait)
     """
     # check if same net
     if cp1.label != cp2.label:
         raise ValueError("Different nets {} {}".format(cp1.label,cp2.label))
 
-    print(aux.color_format("Routing net {}".format(cp1.label),'OKBLUE'))
+    report(aux.color_format("Routing net {}".format(cp1.label),'OKBLUE'))
+
+    # try routers concurrently (daemon workers cannot fork their own)
+    if (portfolio and len(mode) > 1 and
+        not multiprocessing.current_process().daemon):
+        result = route_portfolio(cp1,cp2,layout,drc_cache,mode,
+                                 portfolio_wait)
+        if result:
+            report(aux.color_format("   SUCCESS :D","OKGREEN"))
+            return result
+        report(aux.color_format("   UNSUCCESSFUL :( ","FAIL"),end="")
+        return False
 
     # try each router type
     while len(mode) > 0:
         m = mode[0]
         mode = mode[1:]
-        if m == 'p': # pattern router
-            result = pattern_router.pattern_route_components(
-                cp1,cp2,layout,drc_cache,elevate=False
-            )
-        elif m == 'l': # lee router
-            result = lee_router.lee_route_components(
-                cp1,cp2,layout,drc_cache
-            )
-        else:
-            raise ValueError ("Invalid Mode {}".format(m))
-        print()
+        result = run_router(m,cp1,cp2,layout,drc_cache)
+        report()
 
         # has a solution
         if result:
-            print(aux.color_format("   SUCCESS :D","OKGREEN"))
+            result.router = m
+            report(aux.color_format("   SUCCESS :D","OKGREEN"))
             return result
 
     # no solution
-    print(aux.color_format("   UNSUCCESSFUL :( ","FAIL"),end="")
+    report(aux.color_format("   UNSUCCESSFUL :( ","FAIL"),end="")
     return False
 
+def run_router(m,cp1,cp2,layout,drc_cache):
+    """Route cp1 and cp2 with router m. Returns route or False
+    """
+    if m == 'p': # pattern router
+        return pattern_router.pattern_route_components(
+            cp1,cp2,layout,drc_cache,elevate=False
+        )
+    elif m == 'l': # lee router
+        return lee_router.lee_route_components(
+            cp1,cp2,layout,drc_cache
+        )
+    else:
+        raise ValueError ("Invalid Mode {}".format(m))
+
+def route_portfolio(cp1,cp2,layout,drc_cache,mode,wait=PORTFOLIO_WAIT):
+    """Run each router in mode in its own process. Returns the first route
+    found, or the cheapest found within wait times its elapsed time after
+    it (0 returns the first). An error raised by a router is raised here,
+    and a worker that dies without a result counts as a failure
+    """
+    for m in mode: # fail in parent rather than in a worker
+        if m not in 'pl':
+            raise ValueError ("Invalid Mode {}".format(m))
+
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    procs = [ctx.Process(target=portfolio_worker,
+                         args=(m,cp1,cp2,layout,drc_cache,results))
+             for m in mode]
+    start = time.time()
+    for proc in procs:
+        proc.start()
+
+    best, deadline, error = False, None, None
+    pending = dict(zip(mode,procs))
+    while len(pending) > 0:
+        # workers already gone before waiting cannot post anything more
+        dead = [m for m,proc in pending.items() if proc.exitcode is not None]
+        timeout = PORTFOLIO_POLL
+        if deadline is not None:
+            timeout = min(timeout,max(0,deadline - time.time()))
+        try:
+            m, result = results.get(timeout=timeout)
+        except queue.Empty:
+            if deadline is not None and time.time() >= deadline:
+                break
+            for m in dead:
+                report("   {} router exited ({}) without a result".
+                       format(m,pending[m].exitcode))
+                del pending[m]
+            continue
+        del pending[m]
+        if isinstance(result,Exception):
+            error = result
+            break
+        if result and (not best or result.cost < best.cost):
+            report("   {} router found route of cost {}".format(m,result.cost))
+            result.router = m
+            best = result
+            if deadline is None:
+                deadline = time.time() + wait * (time.time() - start)
+
+    for proc in procs:
+        proc.terminate()
+        proc.join()
+    if error is not None:
+        raise error
+    return best
+
+def portfolio_worker(m,cp1,cp2,layout,drc_cache,results):
+    """Worker: route quietly with router m and put result (or the error
+    raised) on queue"""
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = run_router(m,cp1,cp2,layout,drc_cache)
+    except Exception as e:
+        result = e
+    results.put((m,result))
+
+def prefetch_routes(pairs,layout,route_modes,workers):
+    """Route pairs with non-overlapping search windows in parallel, each
+    against a snapshot of the current layout. Returns dict of
+    frozenset(pair) -> route (or False)
+    """
+    global SNAPSHOT
+
+    # pick pairs whose windows and components are disjoint
+    batch, windows, used = [], [], set()
+    for pair in pairs:
+        if len(batch) == workers:
+            break
+        if pair[0] in used or pair[1] in used:
+            continue
+        window = lee_router.get_window(pair[0],pair[1],
+                                       lee_router.WINDOW_MARGIN,
+                                       layout.bounding_box)
+        if window is None or any(window.overlaps(w) for w in windows):
+            continue
+        batch.append(pair)
+        windows.append(window)
+        used.update(pair)
+
+    # nothing to gain from a single pair
+    if len(batch) < 2:
+        return {}
+
+    SNAPSHOT = (batch,layout,route_modes)
+    with multiprocessing.get_context('fork').Pool(len(batch)) as pool:
+        routes = pool.map(route_snapshot,range(len(batch)))
+    SNAPSHOT = None
+    return {frozenset(pair): route for pair,route in zip(batch,routes)}
+
+def route_snapshot(i):
+    """Worker: route i-th pair of the snapshot quietly"""
+    batch, layout, route_modes = SNAPSHOT
+    with contextlib.redirect_stdout(io.StringIO()):
+        return route_pair(batch[i][0],batch[i][1],layout,layout.drc_cache,
+                          mode=route_modes)
+
+def still_valid(route,added_rects):
+    """Returns True if no rect added since route was found is within
+    spacing of any of its segments
+    """
+    if len(added_rects) == 0:
+        return True
+    for seg in range(len(route.waypoints) - 1):
+        A,B = route.waypoints[seg],route.waypoints[seg+1]
+        contour = ds.make_segment_rect(A,B,None,contoured=True)
+        if any(contour.overlaps(rect) for rect in added_rects):
+            return False
+    return True
+
 def get_total_routes(layout):
     """Returns total number of routes (n - 1) for each net
     """
@@ -10,6 +10,9 @@ Includes:
     net if any
     parent cell if applicable
 - Cell: placed cell information
+- RectIndex: bucketed grid of rectangles for overlap queries
+- OccupancyGrid: array-backed net IDs per layer
+- PinIndex: counts pins overlapping a rectangle
 - GlobalGrid: Contains pointers to cells in coordinate
 - LocalGrid: Contains pointers to rectangles at coordinate
 - Component: area components used when routing
@@ -17,11 +20,13 @@ Includes:
 """
 
 import auxiliary as aux
-from collections import defaultdict
+from collections import defaultdict, deque
 import design_rules as dr
 import lee_router
 import heapq
-from copy import deepcopy
+from array import array
+from itertools import product
+from bisect import bisect_left, bisect_right
 
 
 ##########
@@ -31,24 +36,34 @@ class SPQ:
     """Stable Priority Queue
     Priority queue that serves lowest priority first
     If same priority, then FIFO for that priority
+    Each priority has a deque of items and only distinct priorities are
+    kept in the heap, so items sharing a priority cost O(1) each
     """
     def __init__(self):
-        self.queue = defaultdict(list)
-        self.priorities = []
+        self.queue = {}       # priority -> deque of items
+        self.priorities = []  # heap of distinct priorities in queue
 
     def put(self,priority,item):
         """Add item with given priority to queue
         """
-        self.queue[priority].append(item)
-        heapq.heappush(self.priorities,priority)
+        bucket = self.queue.get(priority)
+        if bucket is None:
+            bucket = self.queue[priority] = deque()
+            heapq.heappush(self.priorities,priority)
+        bucket.append(item)
 
     def get(self):
         """Remove and return the first in item with lowest priority
         If empty, return None
         """
         if len(self.priorities) == 0: return None
-        lowest = heapq.heappop(self.priorities)
-        return self.queue[lowest].pop(0)
+        lowest = self.priorities[0]
+        bucket = self.queue[lowest]
+        item = bucket.popleft()
+        if len(bucket) == 0:
+            heapq.heappop(self.priorities)
+            del self.queue[lowest]
+        return item
 
     def peek(self):
         """Return smallest value in priority without popping
@@ -72,8 +87,39 @@ class CellTemplate:
         self.layout = defaultdict(list)
         for rect in layout:
             self.layout[dr.layers_mat[rect.m]].append(rect)
+        # flat list of rects, indexed by material
+        self.rects = [rect for rects in self.layout.values() for rect in rects]
+        self.rects_material = defaultdict(list)
+        for i,rect in enumerate(self.rects):
+            self.rects_material[rect.m].append(i)
+        self.grid = None # blockage map, see get_grid
+
+        # extent of cell box and geometry (cell coordinates)
+        x0 = min([0] + [r.x for r in self.rects])
+        y0 = min([0] + [r.y for r in self.rects])
+        x1 = max([w] + [r.x + r.w for r in self.rects])
+        y1 = max([h] + [r.y + r.h for r in self.rects])
+        self.extent = (x0,y0,x1 - x0,y1 - y0)
+
+    def get_grid(self):
+        """Returns occupancy grid of the geometry in cell coordinates,
+        holding index + 1 of each rect in rects. Built on first use and
+        shared by all instances
+        """
+        if self.grid is None:
+            layers = [rect.get_layers() for rect in self.rects]
+            n_layers = max([l for ls in layers for l in ls] + [-1]) + 1
+            self.grid = OccupancyGrid.around(self.rects,n_layers)
+            for i,rect in enumerate(self.rects):
+                for l in layers[i]:
+                    self.grid.add_rect(l,rect,i + 1)
+        return self.grid
 
 class Cell:
+    """Placed instance of a CellTemplate (flyweight)
+    Holds the template, location and the nets of its pins; geometry is
+    only materialized when needed
+    """
     def __init__(self,pk,cell_type,cell_lib):
         self.pk = pk
         self.cell_type = cell_type
@@ -81,32 +127,52 @@ class Cell:
 
         # get cell information
         template = cell_lib[cell_type]
+        self.template = template
         self.w, self.h = template.w, template.h
-        self.geometry = deepcopy(template.layout)
-        self.geometry_material= defaultdict(list)
-
-        # tag all rects as coming from this block
-        for layer,rects in self.geometry.items():
-            for rect in rects:
-                rect.bk = pk
-                self.geometry_material[rect.m].append(rect)
+        self.nets = {} # index in template.rects -> net of pin
+        self.pins = {} # index in template.rects -> materialized pin rect
 
     def add_net(self,net,x,y,mat):
         # first check direct material            
         # if not found, then check connected material
         for om in [mat] + dr.other_mats[mat]:
-            for rect in self.geometry_material[om]:
-                if rect.is_in((x,y)):
-                    rect.l = net
+            for i in self.template.rects_material[om]:
+                if self.template.rects[i].is_in((x - self.x,y - self.y)):
+                    self.nets[i] = net
                     return True
-        print("Pin not found"
+        aux.Progress.message("Pin not found"
               "({},{},{}) in  {}".format(x,y,mat,self.cell_type))
 
     def offset(self,dx,dy):
         self.x, self.y = dx, dy        
-        for layer,rects in self.geometry.items():
-            for rect in rects:
-                rect.offset(dx,dy)
+
+    def get_rect(self,i):
+        """Returns new rect i of template at the cell location
+        """
+        t = self.template.rects[i]
+        return Rect(t.x + self.x,t.y + self.y,t.w,t.h,t.m,
+                    self.nets.get(i),self.pk)
+
+    def get_pins(self):
+        """Returns rects with nets, in template order. Materialized once,
+        so the same rects are returned on each call
+        """
+        for i in sorted(self.nets):
+            if i not in self.pins:
+                self.pins[i] = self.get_rect(i)
+        return [self.pins[i] for i in sorted(self.nets)]
+
+    @property
+    def geometry(self):
+        """All rects of the cell at its location by layer (materialized
+        on each use)
+        """
+        pins = {i: pin for i,pin in zip(sorted(self.nets),self.get_pins())}
+        geometry = defaultdict(list)
+        for i,rect in enumerate(self.template.rects):
+            geometry[dr.layers_mat[rect.m]].append(
+                pins[i] if i in pins else self.get_rect(i))
+        return geometry
 
     def get_enclosing_rect(self):
         try:
@@ -115,6 +181,22 @@ class Cell:
             self.enclosing_rect = Rect(self.x,self.y,
                                        self.w,self.h,None,points=False)
             return self.enclosing_rect
+
+    def get_extent_rect(self):
+        """Returns rect covering the cell box and all of its geometry
+        """
+        x,y,w,h = self.template.extent
+        return Rect(self.x + x,self.y + y,w,h,None,points=False)
+
+    def labels_in(self,layer,x0,y0,x1,y1):
+        """Returns set of labels (None if unlabeled) of geometry in layer
+        occupying x0,y0 to x1,y1 (inclusive), looked up in template grid
+        """
+        grid = self.template.get_grid()
+        if layer >= len(grid):
+            return set()
+        ids = grid.ids(layer,x0 - self.x,y0 - self.y,x1 - self.x,y1 - self.y)
+        return set(self.nets.get(i - 1) for i in ids)
                 
     def emit_tcl(self,fp,dump=False,cell_dir='cells/'):
         """Emit tcl command to place cell at x,y
@@ -130,18 +212,15 @@ class Cell:
     def emit_net_rectangles(self,fp):
         """Emit tcl commands to place rectangles with nets
         """        
-        for layer,rects in self.geometry.items():
-            for rect in rects:
-                if rect.l is not None:
-                    rect.emit_tcl(fp)
+        for rect in self.get_pins():
+            rect.emit_tcl(fp)
 
     def get_points(self):
         try:
             return self.points
         except AttributeError:
             self.points = defaultdict(set)
-            for mat,rects in self.geometry_material.items():
-                layer = dr.layers_mat[mat]
+            for layer,rects in self.geometry.items():
                 for rect in rects:
                     self.points[layer] = self.points[layer].union(rect.points)
             return self.points
@@ -165,16 +244,46 @@ class Rect:
         self.l = l
         self.bk = bk # block key
 
-        # only get points if needed
-        if points:
-            self.get_mat_points()
-            self.points = self.get_points()
+        # point sets are only computed when first used
+        self.cached_points, self.cached_mat_points = None, None
+
+    @property
+    def points(self):
+        """Set of (x,y) points of the rectangle (computed on first use)
+        """
+        if self.cached_points is None:
+            self.cached_points = self.get_points()
+        return self.cached_points
+
+    @property
+    def mat_points(self):
+        """Set of lower left points that expand to the rectangle
+        (computed on first use)
+        """
+        if self.cached_mat_points is None:
+            self.cached_mat_points = self.get_mat_points()
+        return self.cached_mat_points
 
     def get_x1_y1(self):
         """Calculate the max x and y
         """
         self.x1, self.y1 = self.x + self.w - 1, self.y + self.h - 1        
 
+    def get_layers(self):
+        """Returns layers occupied by the rect
+        Contacts also occupy the adjacent layers
+        """
+        if self.m in dr.mat_layers:
+            layer = dr.layers_mat[self.m]
+        elif self.m in dr.diff_mats: # diffusion materials (and contacts)
+            layer = dr.diff_mats[self.m]
+        else:
+            raise ValueError("INVALID MATERIAL {}".format(self.m))
+
+        if layer % 2 == 1:
+            return [layer - 1, layer, layer + 1]
+        return [layer]
+
     def offset(self,dx,dy):
         """Offsets the rectangle by dx and dy
         """
@@ -182,7 +291,7 @@ class Rect:
         self.y += dy
         self.x1 += dx
         self.y1 += dy
-        self.get_mat_points()
+        self.cached_points, self.cached_mat_points = None, None
         
     def emit_tcl(self,fp):
         """emit tcl commands to draw rectangle
@@ -261,24 +370,17 @@ class Rect:
     def get_points(self,material=False):
         """Returns the set of points of the rectangle
         """
-        points = set()
-        for i in range(self.x,self.x + self.w):
-            for j in range(self.y,self.y + self.h):
-                point = (i,j,self.m) if material else (i,j)
-                points.add(point)
-        return points
+        xs, ys = range(self.x,self.x + self.w), range(self.y,self.y + self.h)
+        if material:
+            return set(product(xs,ys,[self.m]))
+        return set(product(xs,ys))
 
     def get_mat_points(self):
-        """Calculate set of points in lower left that expands to rect
+        """Returns set of points in lower left that expands to rect
         """
         if self.m not in dr.material_width:
             return set()
-        points = set()
-        width = dr.material_width[self.m]
-        for i in range(self.x,self.x + self.w - width + 1):
-            for j in range(self.y,self.y + self.h - width + 1):
-                points.add((i,j,self.m))
-        self.mat_points = points
+        return Component.get_mat_points(self)
         
     def make_rects(points,material,label=None):
         """Returns list of rects for given set of points and material
@@ -310,6 +412,247 @@ class Rect:
             rects.append(Rect(x0,y0,x1 - x0 + 1, y1 - y0 + 1, material, label))
         return rects 
 
+##########
+# RectIndex
+
+class RectIndex:
+    """Bucketed grid spatial index of rectangles
+    Each rect is stored in every bucket it touches, so a query only looks
+    at the rects in the buckets covered by the query rectangle
+    """
+    BUCKET = 32 # bucket size (lambda)
+
+    def __init__(self,bucket=None):
+        self.bucket = bucket if bucket is not None else RectIndex.BUCKET
+        self.buckets = defaultdict(list)
+
+    def get_buckets(self,x0,y0,x1,y1):
+        """Returns keys of buckets covering x0,y0 to x1,y1 (inclusive)
+        """
+        b = self.bucket
+        return [(bx,by) for bx in range(x0 // b, x1 // b + 1)
+                for by in range(y0 // b, y1 // b + 1)]
+
+    def insert(self,rect,item=None):
+        """Add item covering area of rect. Item defaults to the rect itself
+        """
+        if item is None: item = rect
+        for key in self.get_buckets(rect.x,rect.y,rect.x1,rect.y1):
+            self.buckets[key].append((rect,item))
+
+    def remove(self,rect,item=None):
+        """Remove item previously inserted with rect
+        """
+        if item is None: item = rect
+        for key in self.get_buckets(rect.x,rect.y,rect.x1,rect.y1):
+            entries = self.buckets[key]
+            entries.remove((rect,item))
+            if len(entries) == 0:
+                del self.buckets[key]
+
+    def query(self,rect):
+        """Returns list of items whose rect overlaps rect
+        """
+        x0,y0,x1,y1 = rect.x,rect.y,rect.x1,rect.y1
+        found, seen = [], set()
+        for key in self.get_buckets(x0,y0,x1,y1):
+            if key not in self.buckets: continue
+            for r,item in self.buckets[key]:
+                if item in seen: continue
+                if r.x > x1 or r.x1 < x0 or r.y > y1 or r.y1 < y0: continue
+                seen.add(item)
+                found.append(item)
+        return found
+
+##########
+# OccupancyGrid
+
+class OccupancyGrid:
+    """Array-backed occupancy grid of net IDs per layer
+    Each layer is an int32 array covering the window x0,y0,w,h.
+    A cell is EMPTY, holds a net ID, or is MULTI when more than one ID
+    occupies it (the IDs are then kept in the sparse overflow).
+    Points outside the window are kept in outside.
+    """
+    EMPTY, MULTI = 0, -1
+
+    def __init__(self,x0,y0,w,h,n_layers):
+        self.x0, self.y0 = x0, y0
+        self.w, self.h = max(w,0), max(h,0)
+        self.layers = [array('i',[0]) * (self.w * self.h)
+                       for _ in range(n_layers)]
+        self.overflow = [defaultdict(set) for _ in range(n_layers)]
+        self.outside = [defaultdict(set) for _ in range(n_layers)]
+
+    def around(rects,n_layers):
+        """Returns an empty grid with window covering all rects
+        """
+        if len(rects) == 0:
+            return OccupancyGrid(0,0,0,0,n_layers)
+        x0 = min(r.x for r in rects)
+        y0 = min(r.y for r in rects)
+        x1 = max(r.x + r.w for r in rects)
+        y1 = max(r.y + r.h for r in rects)
+        return OccupancyGrid(x0,y0,x1 - x0,y1 - y0,n_layers)
+
+    def __len__(self):
+        return len(self.layers)
+
+    def add_point(self,layer,x,y,nid):
+        """Mark point x,y of layer as occupied by nid
+        """
+        i, j = x - self.x0, y - self.y0
+        if i < 0 or j < 0 or i >= self.w or j >= self.h:
+            self.outside[layer][(x,y)].add(nid)
+            return
+        cells = self.layers[layer]
+        k = j * self.w + i
+        current = cells[k]
+        if current == OccupancyGrid.EMPTY or current == nid:
+            cells[k] = nid
+        elif current == OccupancyGrid.MULTI:
+            self.overflow[layer][(x,y)].add(nid)
+        else:
+            cells[k] = OccupancyGrid.MULTI
+            self.overflow[layer][(x,y)].update([current,nid])
+
+    def add_rect(self,layer,rect,nid):
+        """Mark every point of rect in layer as occupied by nid
+        Rows that are empty (or already nid) are written as one slice
+        """
+        cells, w = self.layers[layer], self.w
+        i0, i1 = max(rect.x - self.x0, 0), min(rect.x1 - self.x0, w - 1)
+        j0, j1 = max(rect.y - self.y0, 0), min(rect.y1 - self.y0, self.h - 1)
+        if i0 <= i1 and j0 <= j1:
+            n = i1 - i0 + 1
+            fill = array('i',[nid]) * n
+            for j in range(j0, j1 + 1):
+                start = j * w + i0
+                row = cells[start:start + n]
+                if row.count(OccupancyGrid.EMPTY) + row.count(nid) == n:
+                    cells[start:start + n] = fill
+                else:
+                    for i in range(i0, i1 + 1):
+                        self.add_point(layer,self.x0 + i,self.y0 + j,nid)
+        else:
+            i0, i1, j0, j1 = 0, -1, 0, -1
+
+        # parts of rect outside the window
+        if i1 - i0 + 1 == rect.w and j1 - j0 + 1 == rect.h: return
+        for x in range(rect.x, rect.x1 + 1):
+            for y in range(rect.y, rect.y1 + 1):
+                if (i0 <= x - self.x0 <= i1 and j0 <= y - self.y0 <= j1):
+                    continue
+                self.add_point(layer,x,y,nid)
+
+    def ids(self,layer,x0,y0,x1,y1):
+        """Returns set of IDs occupying x0,y0 to x1,y1 (inclusive)
+        """
+        found = set()
+        cells, w = self.layers[layer], self.w
+        i0, i1 = max(x0 - self.x0, 0), min(x1 - self.x0, w - 1)
+        j0, j1 = max(y0 - self.y0, 0), min(y1 - self.y0, self.h - 1)
+        if i0 <= i1:
+            for j in range(j0, j1 + 1):
+                row = cells[j * w + i0:j * w + i1 + 1]
+                found.update(row)
+                if OccupancyGrid.MULTI in found:
+                    found.discard(OccupancyGrid.MULTI)
+                    for i,v in enumerate(row):
+                        if v == OccupancyGrid.MULTI:
+                            point = (self.x0 + i0 + i, self.y0 + j)
+                            found.update(self.overflow[layer][point])
+        for (x,y),nids in self.outside[layer].items():
+            if x0 <= x <= x1 and y0 <= y <= y1:
+                found.update(nids)
+        found.discard(OccupancyGrid.EMPTY)
+        return found
+
+##########
+# PinIndex
+
+class PinIndex:
+    """Counts pins (rects) overlapping a query rect in O(log^2 n), with the
+    semantics of Rect.overlaps. A pin misses the query if it is left of,
+    right of, below or above it; the misses are counted by inclusion-
+    exclusion (left/right and below/above are exclusive for pins with
+    w,h >= 1), using sorted edges and corner counters.
+    Degenerate pins (w or h < 1) are checked one by one.
+    """
+    def __init__(self,rects,by_net=True):
+        odd = [r for r in rects if r.w < 1 or r.h < 1]
+        rects = [r for r in rects if r.w >= 1 and r.h >= 1]
+        self.n = len(rects)
+        self.odd = odd
+        self.x0s = sorted(r.x for r in rects)
+        self.x1s = sorted(r.x1 for r in rects)
+        self.y0s = sorted(r.y for r in rects)
+        self.y1s = sorted(r.y1 for r in rects)
+        self.left_below = DominanceCounter([(r.x1,r.y1) for r in rects])
+        self.left_above = DominanceCounter([(r.x1,r.y) for r in rects])
+        self.right_below = DominanceCounter([(r.x,r.y1) for r in rects])
+        self.right_above = DominanceCounter([(r.x,r.y) for r in rects])
+
+        # per net indices for exclusion
+        self.nets = {}
+        if by_net:
+            nets = defaultdict(list)
+            for r in rects + odd:
+                nets[r.l].append(r)
+            self.nets = {l: PinIndex(rs,by_net=False)
+                         for l,rs in nets.items()}
+
+    def count(self,rect,exclude=None):
+        """Returns number of pins overlapping rect, not counting pins of
+        net exclude
+        """
+        qx0, qx1 = rect.x, rect.x + rect.w - 1
+        qy0, qy1 = rect.y, rect.y + rect.h - 1
+        n = self.n
+
+        left = bisect_left(self.x1s,qx0)
+        right = n - bisect_right(self.x0s,qx1)
+        below = bisect_left(self.y1s,qy0)
+        above = n - bisect_right(self.y0s,qy1)
+        left_below = self.left_below.count(qx0,qy0)
+        left_above = left - self.left_above.count(qx0,qy1 + 1)
+        right_below = below - self.right_below.count(qx1 + 1,qy0)
+        right_above = (right + above - n +
+                       self.right_above.count(qx1 + 1,qy1 + 1))
+        missed = (left + right + below + above -
+                  left_below - left_above - right_below - right_above)
+
+        total = n - missed + sum(1 for r in self.odd if rect.overlaps(r))
+        if exclude is not None and exclude in self.nets:
+            total -= self.nets[exclude].count(rect)
+        return total
+
+class DominanceCounter:
+    """Counts points (a,b) with a < x and b < y. Fenwick tree over points
+    sorted by a, each node holding the sorted b's of its range
+    """
+    def __init__(self,points):
+        points = sorted(points)
+        self.a = [p[0] for p in points]
+        self.tree = [[] for _ in range(len(points) + 1)]
+        for i,(_,b) in enumerate(points):
+            j = i + 1
+            while j < len(self.tree):
+                self.tree[j].append(b)
+                j += j & -j
+        for node in self.tree:
+            node.sort()
+
+    def count(self,x,y):
+        """Returns number of points with a < x and b < y
+        """
+        total = 0
+        i = bisect_left(self.a,x)
+        while i > 0:
+            total += bisect_left(self.tree[i],y)
+            i -= i & -i
+        return total
+
 ##########
 # GlobalGrid
 
@@ -323,6 +666,8 @@ class Rect:
 class Component:
     """Connected Component
     """
+    FRONTIER_STEP = 4 # spacing of frontier points sampled along segments
+
     def __init__(self,label):
         """Initialize a component by given a node (as rect)
         """
@@ -336,6 +681,7 @@ class Component:
         # key: junction_point, val: list of segments
         self.junctions = defaultdict(list)
         self.x0,self.x1,self.y0,self.y1 = None,None,None,None
+        self.version = 0 # bumped whenever line changes (see aux distances)
 
     def add_block(self,bk):
         """Add the block key to list of blocks the component interacts with
@@ -359,11 +705,9 @@ class Component:
         if mat is None: mat = rect.m
         # if mat not in dr.material_order: return set()
         width = dr.material_width[mat]
-        line = set()
-        for x in range(rect.x,rect.x + rect.w - width + 1):
-            for y in range(rect.y,rect.y + rect.h - width + 1):
-                line.add((x,y,mat))
-        return line
+        return set(product(range(rect.x,rect.x + rect.w - width + 1),
+                           range(rect.y,rect.y + rect.h - width + 1),
+                           [mat]))
     
     def add_node(self,node,layout=None):
         """Add node (given as rect) to component
@@ -372,15 +716,40 @@ class Component:
 
         if node.m in dr.contact_materials:
             for mat in dr.contact_materials[node.m]:
-                self.line = self.line.union(Component.get_mat_points(node,mat))
+                self.line.update(Component.get_mat_points(node,mat))
                 point = (node.x,node.y,mat)
                 self.junctions[point].append([point,node])
         else:
-            self.line = self.line.union(node.mat_points)
+            self.line.update(node.mat_points)
             point = (node.x,node.y,node.m)
             self.junctions[point].append([point,node])
+        self.version += 1
         self.get_corners()
 
+    def frontier(self,step=None):
+        """Returns the set of points to start routing from: the perimeter
+        of each node area, the endpoints of each segment and points sampled
+        every step (default FRONTIER_STEP) along each segment
+        """
+        if step is None: step = Component.FRONTIER_STEP
+        points = set()
+        for node in self.nodes:
+            for mat in dr.contact_materials.get(node.m,[node.m]):
+                if mat not in dr.material_width: continue
+                width = dr.material_width[mat]
+                x0, x1 = node.x, node.x + node.w - width
+                y0, y1 = node.y, node.y + node.h - width
+                for x in range(x0,x1 + 1):
+                    points.update([(x,y0,mat),(x,y1,mat)])
+                for y in range(y0,y1 + 1):
+                    points.update([(x0,y,mat),(x1,y,mat)])
+        for a,b in self.segments:
+            drtn = aux.get_dir(a,b)
+            low, high = min(a[drtn],b[drtn]), max(a[drtn],b[drtn])
+            for i in list(range(low,high,step)) + [high]:
+                points.add((a[0],i,a[2]) if drtn else (i,a[1],a[2]))
+        return points
+
     def elevate(self,dest_mat,layout,platform_sf=5):
         """Elevator to quickly increase layer
         Creates large platform at dest_mat then use lee router to join
@@ -390,7 +759,7 @@ class Component:
 
         # origin is the only node in the component
         if len(self.nodes) > 1:
-            print("multiple nodes. picking one")
+            aux.Progress.message("multiple nodes. picking one")
             # raise ValueError("Cannot have multiple nodes in component")
         origin = self.nodes[0]
 
@@ -410,9 +779,13 @@ class Component:
         route = lee_router.lee_route_components(self,platform_cpn,layout,
                                             layout.drc_cache,vertical=True)
         if route:
+            # keep layout route index up to date
+            registered = self in layout.components[self.label]
+            if registered: layout.remove_component(self)
             self.add_route(route)
+            if registered: layout.add_component(self)
         else:            
-            print("    Unable to elevate Rect{} to {}".
+            aux.Progress.message("    Unable to elevate Rect{} to {}".
                   format((origin.x,origin.y,origin.w,origin.h,origin.m),
                          dest_mat))
         
@@ -488,6 +861,7 @@ class Component:
 
         # add points on line
         self.line = self.line.union(list_line(segment))
+        self.version += 1
 
         # create junctions
         self.junctions[segment[0]].append(segment)
@@ -521,6 +895,7 @@ class Component:
             if (ep in self.junctions and len(self.junctions[ep]) == 1 and
                 ep in self.line):
                 self.line.remove(ep)
+        self.version += 1
 
         # remove rectangle of segment
         self.segments.remove(tuple(segment))
@@ -745,7 +1120,8 @@ class Route:
         return materials
 
     def from_points(points):
-        """Generate and return route given a list of points (from Lee)
+        """Generate and return route given an iterable of points (from Lee)
+        Points are consumed in one pass, so a generator can be given
         """
         curr_direction, curr_mat = None, None
         curr_start, curr_end = None, None
@@ -5,15 +5,81 @@
 import data_structures as ds
 import auxiliary as aux
 import design_rules as dr
-from pprint import pprint
+import telemetry
+
+from collections import OrderedDict, defaultdict
 
 class Cache:
-    """DRC Cache for memoization of design rule checks 
-    """    
+    """DRC Cache for memoization of design rule checks
+    layout: segment key -> drawable w.r.t. layout (layout never changes)
+    route: (segment key, component, segment) -> conflicts with route
+    Both are LRU bounded by size. Route entries of a component are
+    dropped with invalidate when it is added to/removed from the layout
+    """
+    SIZE = 2 ** 20 # max entries per table
+
+    def __init__(self,size=None):
+        self.size = size if size is not None else Cache.SIZE
+        self.layout = OrderedDict()
+        self.route = OrderedDict()
+        self.by_component = defaultdict(set) # component -> route keys
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def get(self,table,key):
+        """Returns cached value of key in table, or None if not cached
+        """
+        value = table.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            table.move_to_end(key)
+        return value
+
+    def get_layout(self,key):
+        return self.get(self.layout,key)
+
+    def get_route(self,key,comp_key):
+        return self.get(self.route,(key,) + comp_key)
+
+    def set_layout(self,key,value):
+        self.layout[key] = value
+        if len(self.layout) > self.size:
+            self.layout.popitem(last=False)
+            self.evictions += 1
+
+    def set_route(self,key,comp_key,value):
+        route_key = (key,) + comp_key
+        self.route[route_key] = value
+        self.by_component[comp_key[0]].add(route_key)
+        if len(self.route) > self.size:
+            old, _ = self.route.popitem(last=False)
+            self.forget(old)
+            self.evictions += 1
+
+    def forget(self,route_key):
+        """Drop route_key from the component's set of keys
+        """
+        keys = self.by_component[route_key[1]]
+        keys.discard(route_key)
+        if len(keys) == 0:
+            del self.by_component[route_key[1]]
 
-    def __init__(self):
-        self.layout = {}
-        self.route = {}
+    def invalidate(self,component):
+        """Remove all route entries involving component
+        """
+        for route_key in self.by_component.pop(component,()):
+            del self.route[route_key]
+
+    def summary(self):
+        """Returns string of cache statistics
+        """
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups > 0 else 0
+        return ("DRC cache: {} hits | {} misses ({:.1%} hit rate) | "
+                "{} evictions | {} entries".
+                format(self.hits,self.misses,rate,self.evictions,
+                       len(self.layout) + len(self.route)))
 
 class ComponentConflict:
     """Conflict with existing component
@@ -30,11 +96,6 @@ def check_segment(A,B,label,layout,drc_cache,point=False,components=[]):
     If point is True, then it allows getting close to existing net
     """
 
-    @aux.Timer.timeit
-    def get_search_points(search_area,grid_points):
-        # POSSIBLE TO CACHE THIS!
-        return [gp for gp in grid_points if search_area.is_in(gp)]
-
     def get_layers():
         """Return layers the segment should check
         """
@@ -52,134 +113,69 @@ def check_segment(A,B,label,layout,drc_cache,point=False,components=[]):
         """Search through existing layout
         """
         contact = mat in dr.contact_materials
+        area = (search_area.x,search_area.y,search_area.x1,search_area.y1)
+        # placed blocks near the search area
+        blocks = []
+        if len(layout.blocks) > 0:
+            blocks = [layout.blocks[bid - 1]
+                      for bid in layout.block_grid.ids(0,*area)]
         for l in get_layers():
             # ignore invalid layers
-            if l >= len(layout.grid) or l < 0: continue
-            # mask grid with search area
-
-            # for placed mode, points are from blocks
-            if layout.mode == 'placed':
-                blocks = []
-                for block in layout.blocks:
-                    if block.get_enclosing_rect().overlaps(search_area):
-                        blocks.append(block)
-
-                # grid_points = set()
-                grid_points = []
-                for b in blocks:
-                    pprint(b.get_points())
-                    grid_points += b.get_points()[l]
-                    # grid_points = grid_points.union(b.get_points()[l])
-            else:
-                grid_points = layout.grid_points[l]
-            search_points = get_search_points(search_area,grid_points)
-            searched_rects = set()
-            for sp in search_points:
-                existing_rects = layout.grid[l][sp]
-                for rect in existing_rects:
-                    # already ok
-                    if rect in searched_rects: continue
-
-                    # different net conflict
-                    if contact or rect.l != label:
-                        return False
-
-                    '''
-                    # different component of same net
-                    in_comp = False
-                    for comp in components:
-                        if rect in comp.nodes:
-                            in_comp = True
-                            break
-                    if not in_comp: return False
-                    '''
-
-                    searched_rects.add(rect)
+            if l >= len(layout.rect_index) or l < 0: continue
+            # only rects overlapping the search area
+            for rect in layout.rect_index[l].query(search_area):
+                # different net conflict
+                if contact or rect.l != label:
+                    return False
+
+            # block geometry, looked up in its cell template
+            for block in blocks:
+                labels = block.labels_in(l,*area)
+                if contact and len(labels) > 0:
+                    return False
+                if any(l2 != label for l2 in labels):
+                    return False
 
         return True
 
     @aux.Timer.timeit
     def with_routes():
-        """Search through existing routes
+        """Search through existing routes that overlap the search area
         """
         conflicts = []
         for l in get_layers():
             # ignore invalid layers
-            if l >= len(layout.grid) or l < 0: continue
-            # mask grid with search area
-            comp_points = layout.comp_points[l]
-            search_points = get_search_points(search_area,comp_points)
-            searched_components = set()
-            for sp in search_points:
-                comps = layout.comp_grid[l][sp]
-                for comp in comps:
-                    if comp in searched_components: continue
-                    net = comp.label
-                    for seg,rect in comp.seg_rects.items():
-                        comp_key = (comp,seg) # component key
-                        seg_layer = dr.layers_mat[rect.m]
-                        if comp_key not in drc_cache.route[key]:
-                            # different net and overlaps
-                            if (net != label and
-                                seg_layer == layer and
-                                rect.overlaps(search_area)):
-                                drc_cache.route[key][comp_key] = True
-                            # contact overlapping another contact
-                            elif (mat in dr.contact_materials and
-                                rect.m in dr.contact_materials and
-                                abs(layer - seg_layer) < 3 and
-                                rect.overlaps(contact_search)):
-                                drc_cache.route[key][comp_key] = True
-                            # same net and parallel without enough spacing
-                            elif (not point and net == label and
-                                  not check_parallel_spacing((A,B),seg)):
-                                drc_cache.route[key][comp_key] = True
-                            else:
-                                drc_cache.route[key][comp_key] = False
-                        if drc_cache.route[key][comp_key]:
-                            conflict = ComponentConflict((A,B),label,comp,seg)
-                            conflicts.append(conflict)
-                    searched_components.add(comp)
-        return conflicts
-                    
-            
-        
-
-    @aux.Timer.timeit
-    def with_routes_old():
-        """Search through existing routes
-        """
-        conflicts = []
-        for net in layout.labels:
-            # search through components
-            for comp in layout.components[net]:
-                for seg,rect in comp.seg_rects.items():
-                    comp_key = (comp,seg) # component key
-                    seg_layer = dr.layers_mat[rect.m]
-                    if comp_key not in drc_cache.route[key]:
-                        # different net and overlaps
-                        if (net != label and
-                            seg_layer == layer and
-                            rect.overlaps(search_area)):
-                            drc_cache.route[key][comp_key] = True
-                        # contact overlapping another contact
-                        elif (mat in dr.contact_materials and
-                            rect.m in dr.contact_materials and
-                            abs(layer - seg_layer) < 3 and
-                            rect.overlaps(contact_search)):
-                            drc_cache.route[key][comp_key] = True
-                        # same net and parallel without enough spacing
-                        elif (not point and net == label and
-                              not check_parallel_spacing((A,B),seg)):
-                            drc_cache.route[key][comp_key] = True
-                        else:
-                            drc_cache.route[key][comp_key] = False
-                    if drc_cache.route[key][comp_key]:
-                        conflict = ComponentConflict((A,B),label,comp,seg)
-                        conflicts.append(conflict)
+            if l >= len(layout.route_index) or l < 0: continue
+            for comp,seg in layout.route_index[l].query(search_area):
+                rect = comp.seg_rects[seg]
+                net = comp.label
+                comp_key = (comp,seg) # component key
+                seg_layer = dr.layers_mat[rect.m]
+                conflict = drc_cache.get_route(key,comp_key)
+                if conflict is None:
+                    # different net and overlaps
+                    if (net != label and
+                        seg_layer == layer and
+                        rect.overlaps(search_area)):
+                        conflict = True
+                    # contact overlapping another contact
+                    elif (mat in dr.contact_materials and
+                        rect.m in dr.contact_materials and
+                        abs(layer - seg_layer) < 3 and
+                        rect.overlaps(contact_search)):
+                        conflict = True
+                    # same net and parallel without enough spacing
+                    elif (not point and net == label and
+                          not check_parallel_spacing((A,B),seg)):
+                        conflict = True
+                    else:
+                        conflict = False
+                    drc_cache.set_route(key,comp_key,conflict)
+                if conflict:
+                    conflict = ComponentConflict((A,B),label,comp,seg)
+                    conflicts.append(conflict)
         return conflicts
 
-
     def check_parallel_spacing(seg1,seg2):
         """Given two segments, return False if parallel and closer than 
         minimum spacing, else return True
@@ -217,6 +213,8 @@ def check_segment(A,B,label,layout,drc_cache,point=False,components=[]):
         return search_area, contact_search
         
 
+    telemetry.counts['drc_calls'] += 1
+
     # key for caching
     key = (A,B,label)
 
@@ -228,15 +226,15 @@ def check_segment(A,B,label,layout,drc_cache,point=False,components=[]):
     layer = dr.layers_mat[mat]
 
     # search through existing layout
-    if key not in drc_cache.layout:
-        drc_cache.layout[key] = with_layout()
-    if not drc_cache.layout[key]:
+    drawable = drc_cache.get_layout(key)
+    if drawable is None:
+        drawable = with_layout()
+        drc_cache.set_layout(key,drawable)
+    if not drawable:
         return False
                 
     # search through existing routes
-    if key not in drc_cache.route:
-        drc_cache.route[key] = {} # initialize entry for segment        
-    conflicts = with_routes_old()
+    conflicts = with_routes()
 
     if len(conflicts) > 0:
         return conflicts
@@ -9,20 +9,25 @@ from collections import defaultdict
 import mag_reader
 import auxiliary as aux
 import design_rule_checker as drc
+import tcl_emitter
+
+# print through verbosity levels (see aux.Progress)
+report = aux.Progress.message
 
 class Layout:
 
     BB_SF = 1.1 # Bounding box scale factor
 
     def __init__(self,inputs):
-        print(aux.color_format("INITIALIZING LAYOUT","HEADER"))
+        report(aux.color_format("INITIALIZING LAYOUT","HEADER"))
         
         self.nodes = defaultdict(list)
-        self.grid = [defaultdict(list) for _ in range(inputs['layers'])]
-        self.grid_points = {}
-        self.block_grid = defaultdict(list) # pointer to block for each point
-        self.comp_grid = [defaultdict(list) for _ in range(inputs['layers'])]
-        self.comp_points = defaultdict(set)                          
+        # rects per layer, for layout checks
+        self.rect_index = [ds.RectIndex() for _ in range(inputs['layers'])]
+        # block ID (index in blocks + 1), window set in placed mode
+        self.block_grid = ds.OccupancyGrid(0,0,0,0,1)
+        # routed segment rects of components (item: (component,segment))
+        self.route_index = [ds.RectIndex() for _ in range(inputs['layers'])]
         self.components = defaultdict(list)
         self.labels = set()
         self.rects = []
@@ -32,7 +37,7 @@ class Layout:
         mode = inputs['input_mode']
         self.mode = mode
         if mode == 'explicit':
-            print("  Reading rectangles")
+            report("  Reading rectangles")
             for rect in inputs['rects']:
                 self.add_rect(rect)
         elif mode == 'placed':
@@ -40,10 +45,10 @@ class Layout:
         else:
             raise ValueError("Input mode is either explicit or placed")
 
-        for layer,points in enumerate(self.grid):
-            self.grid_points[layer] = set(points)
-            
         self.bounding_box = self.get_bounding_box()
+        # range counts of pins for ordering
+        self.pin_index = ds.PinIndex([n for net in self.labels
+                                      for n in self.nodes[net]])
 
     def elevate(self,start_mat,end_mat):
         """Elevate nodes that start with start_mat to end_mat
@@ -51,16 +56,17 @@ class Layout:
         n_components = sum([len(self.components[net]) for net in self.labels])
         elevating = 1        
         for net in self.labels:
-            for c in self.components[net]:
-                print("  Elevating {}/{} ".
-                      format(elevating,n_components),end="\r")
+            for c in list(self.components[net]):
+                report("  Elevating {}/{} ".
+                       format(elevating,n_components),end="\r")
                 elevating += 1
                 if c.nodes[0].m == start_mat:
                     c.elevate(end_mat,self)
 
         
-    def add_rect(self,rect):
-        """Adds the rect to the grid. If rect has label, add to nodes.
+    def add_rect(self,rect,index=True):
+        """Adds the rect to the rect index. If rect has label, add to nodes.
+        Block geometry is not indexed (see Cell.labels_in)
         """
 
         if rect.l is not None:
@@ -77,46 +83,33 @@ class Layout:
             self.labels.add(rect.l)
 
         self.rects.append(rect)
-            
-        # get layer
-        if rect.m in dr.mat_layers:
-            layer = dr.layers_mat[rect.m]
-        elif rect.m in dr.diff_mats: # diffusion materials (and contacts)
-            layer = dr.diff_mats[rect.m]
-        else:
-            raise ValueError("INVALID MATERIAL {}".format(rect.m))
 
         # contacts also add adjacent layers
-        if layer % 2 == 1:
-            layers = [layer - 1, layer, layer + 1]
-        else:
-            layers = [layer]
-        
-        for x in range(rect.x, rect.x1 + 1):
-            for y in range(rect.y, rect.y1 + 1):
-                for l in layers:
-                    self.grid[l][(x,y)].append(rect)
+        if not index: return
+        for l in rect.get_layers():
+            self.rect_index[l].insert(rect)
 
     def emit_tcl(self,filename):
         """Output tcl to draw layout in filename
         """
 
-        with open(filename,'w') as f:
+        with tcl_emitter.Emitter.open(filename) as emitter:
             if self.mode == 'explicit':            
                 # output existing layouts
                 for rect in self.rects:
-                    rect.emit_tcl(f)
+                    emitter.add_rect(rect)
             else:
                 for b in self.blocks:
-                    b.emit_tcl(f)
+                    emitter.add_cell(b)
                 for l,nodes in self.nodes.items():
                     for n in nodes:
-                        n.emit_tcl(f)
+                        emitter.add_rect(n)
                 
             
             # output components
             for net,comps in self.components.items():                
-                [comp.emit_tcl(f) for comp in comps]
+                for comp in comps:
+                    emitter.add_component(comp)
 
     def get_bounding_box(self):
         """Returns bounding box of layout (as rect)
@@ -129,7 +122,7 @@ class Layout:
             if x0 is None or r.x < x0:
                 x0 = r.x
             if x1 is None or r.x1 > x1:
-                x1 = r.x
+                x1 = r.x1
             if y0 is None or r.y < y0:
                 y0 = r.y
             if y1 is None or r.y1 > y1:
@@ -154,7 +147,7 @@ class Layout:
                     raise ValueError("Cell width and height mismatch")
 
         def get_nodelist(nodefile,blocks,cell_lib):
-            print(nodefile, end = ' ', flush=True)
+            report(nodefile, end = ' ', flush=True)
             with open(nodefile) as f:
                 for l in f:
                     t = l.split()
@@ -164,7 +157,7 @@ class Layout:
                         blocks[t[0]] = ds.Cell(t[0],t[3],cell_lib)
 
         def get_netlist(netfile,blocks):
-            print(netfile, end = ' ', flush=True)
+            report(netfile, end = ' ', flush=True)
             with open(netfile) as f:
                 nets = {}
                 current_net = None
@@ -180,7 +173,7 @@ class Layout:
                         # nets[current_net].append((t[0],t[3],t[4],t[5]))
 
         def get_placement(placefile,blocks):
-            print(placefile)
+            report(placefile)
             with open(placefile) as f:
                 for l in f:
                     t = l.split()
@@ -190,7 +183,7 @@ class Layout:
                         blocks[pk].offset(x,y)
 
         # Print status
-        print("  Reading Placement from ",end=' ',flush=True)
+        report("  Reading Placement from ",end=' ',flush=True)
 
         # initialize cell library and blocks dictionary
         cell_lib, blocks = {}, {}
@@ -200,12 +193,15 @@ class Layout:
         get_netlist(inputs['netfile'],blocks)
         get_placement(inputs['placefile'],blocks)
 
-        # add pins from block
+        # only blocks are gridded, with a window covering their geometry
+        self.block_grid = ds.OccupancyGrid.around(
+            [b.get_extent_rect() for pk,b in blocks.items()],1)
+
+        # add pins from block (geometry is checked through its block)
         for pk,b in blocks.items():
-            for layer,rects in b.geometry.items():
-                for rect in rects:
-                    # if rect.l is not None:
-                    self.add_rect(rect)
+            for rect in b.get_pins():
+                self.add_rect(rect,index=False)
+            self.rects.append(b.get_extent_rect()) # for bounding box
             self.add_block(b)
 
     def add_block(self,block):
@@ -215,31 +211,23 @@ class Layout:
         # add block
         self.blocks.append(block)
         
-        # add block pointer to grid
-        for x in range(block.x, block.x + block.w):
-            for y in range(block.y, block.y + block.h):
-                self.block_grid[(x,y)].append(block)
+        # add block ID to grid
+        self.block_grid.add_rect(0,block.get_extent_rect(),len(self.blocks))
     
     def add_component(self,component):
-        """Adds component to layout and comp_grid
+        """Adds component to layout and route_index
         """
         self.components[component.label].append(component)
-        c_points = component.get_points()
-        for cp in c_points:
-            key = cp[:2]
-            layer = dr.layers_mat[cp[2]]
-            self.comp_grid[layer][key].append(component)
-            self.comp_points[layer].add(key)
+        self.drc_cache.invalidate(component)
+        for seg,rect in component.seg_rects.items():
+            layer = dr.layers_mat[rect.m]
+            self.route_index[layer].insert(rect,(component,seg))
 
     def remove_component(self,component):
-        """Removes component from layout and comp_grid
+        """Removes component from layout and route_index
         """
         self.components[component.label].remove(component)
-        c_points = component.get_points()
-        for cp in c_points:
-            key = cp[:2]
-            layer = dr.layers_mat[cp[2]]
-            self.comp_grid[layer][key].remove(component)
-            if len(self.comp_grid[layer][key]) == 0:
-                self.comp_points[layer].remove(key)
-
+        self.drc_cache.invalidate(component)
+        for seg,rect in component.seg_rects.items():
+            layer = dr.layers_mat[rect.m]
+            self.route_index[layer].remove(rect,(component,seg))
@@ -6,90 +6,125 @@ import data_structures as ds
 import auxiliary as aux
 import design_rules as dr
 import design_rule_checker as drc
+import telemetry
 
 import time
+from array import array
+from itertools import chain
 
 TIMEOUT = 120
+ASTAR = True # expand by cost + lower bound to the other component
+WINDOW_MARGIN = 20 # margin around the components searched first (lambda)
+WINDOW_GROWTH = 2  # margin scale factor each time the window search fails
+
+# lower bounds for the A* heuristic
+MIN_STEP_COST = min(dr.material_cost[m] * dr.material_width[m]
+                    for m in dr.routing_materials)
+MIN_LAYER_COST = min(dr.material_cost[m] * dr.material_width[m] ** 2
+                     for m in dr.mat_layers)
 
 @aux.Timer.timeit
-def lee_route_components(cp1,cp2,layout,drc_cache,vertical=False):
+def lee_route_components(cp1,cp2,layout,drc_cache,vertical=False,
+                         astar=ASTAR,margin=WINDOW_MARGIN):
     """Genereate route between cp1 and cp2 using Lee's algorithm
     Return route if possible, False otherwise.
     
     vertical option waives contact cost (used for pin elevation)
+    astar option orders the expansion by cost plus a lower bound on the
+    remaining cost to the other component
+    margin is the initial space around the two components to search.
+    The window is clipped to the layout bounding box. If no route is
+    found, the margin grows until the window is the whole bounding box
+    """
+    start_time = time.time()
+    bounds = layout.bounding_box
+    while True:
+        window = get_window(cp1,cp2,margin,bounds)
+        route = lee_route_window(cp1,cp2,layout,drc_cache,window,
+                                 vertical,astar,start_time)
+        if route or time.time() - start_time > TIMEOUT:
+            return route
+        if window is None or same_area(window,bounds):
+            return False
+        margin *= WINDOW_GROWTH
+
+def lee_route_window(cp1,cp2,layout,drc_cache,window,vertical,astar,
+                     start_time):
+    """Lee's algorithm between cp1 and cp2 restricted to window (as rect)
+    Return route if possible, False otherwise.
     """
 
     # Initialize variables
-    visited = {} # dictionary of visited points
+    if window is None: return False
+    space = LeeSpace(window) # arrays of search state
     queue = ds.SPQ()
-    found = False
-    start_time = time.time()
     label = cp1.label
 
-    # Generate starting points and add to queue
-    starting_points = get_starting_points([cp1,cp2],visited)
-    for component,points in starting_points.items():
+    # Generate starting points and add to queue. The other side can be
+    # met anywhere on its line, so that is the target of each side
+    starting_points, lines = get_starting_points([cp1,cp2],space,window)
+    targets = [get_target(lines[1]),get_target(lines[0])]
+    for side,points in enumerate(starting_points):
         for sp in points:
-            queue.put(0,(sp,component))
+            h = heuristic(sp,targets[side],vertical) if astar else 0
+            queue.put(h,space.index(sp,side))
 
     # Keep going until no more valid points or path found
-    while not queue.empty() and not found:
+    while not queue.empty():
 
         # Timeout
         if time.time() - start_time > TIMEOUT:
             break        
 
         # Get information
-        vertex, cpn = queue.get()
-        info = visited[(vertex,cpn)]
-
-        # Check bounding box
-        if not layout.bounding_box.is_in(vertex):
-            continue
+        current = queue.get()
+        vertex, side = space.point(current), space.side(current)
 
         # Print status
         # if not vertical:
-        if not vertical: print_status(info.cost,start_time)
+        if not vertical: print_status(space.cost[current],start_time)
 
         # Get direction changes
-        changes = get_changes(vertex,info)
+        telemetry.counts['lee_expansions'] += 1
+        changes = get_changes(vertex,space,current)
 
         # Check each change
         for change in changes:
             # In vertical mode, cp1 can only go up, cp2 can only go down
             if vertical:
-                if cpn == cp1 and change == (0,0,-1): continue
-                if cpn == cp2 and change == (0,0,1): continue
+                if side == 0 and change == (0,0,-1): continue
+                if side == 1 and change == (0,0,1): continue
 
             # Get new mat/continue if not valid
-            mat = get_mat(info,change)
+            mat = get_mat(vertex[2],change)
             if not mat: continue
 
-            # New vertex
+            # New vertex (must be inside the window, and so the layout)
             new = (vertex[0] + change[0], vertex[1] + change[1], mat)
-            key = (new,info.component)
-            new_info = get_info(info,change,new,vertical)            
-            if key in visited: continue
+            if not window.is_in(new): continue
+            key = space.index(new,side)
+            if space.state[key] != LeeSpace.UNVISITED: continue
+            space.extend(key,current,change,mat,vertical)
 
             # Check if found path
-            match = find_match(new,new_info,visited,[cp1,cp2])
-            if match:
-                found = True
-                
-                # retrace
-                route_points = (new_info.retrace() +
-                                list(reversed(visited[match].retrace())))
+            match = find_match(new,key,space)
+            if match is not None:
+                # retrace: origin of cp1 side to new, then back along the
+                # parents of the match to the origin of the other side
+                route_points = chain(space.retrace(key),space.walk(match))
                 return ds.Route.from_points(route_points)
 
             # Check if drawable
             drawable = drc.check_point(new,label,layout,drc_cache)
             if not drawable or isinstance(drawable,list):
-                visited[key] = False
+                space.state[key] = LeeSpace.BLOCKED
                 continue
             
-            # Add info to visited and add to queue
-            visited[key] = new_info
-            queue.put(new_info.cost,(new,cpn))
+            # Mark visited and add to queue
+            space.state[key] = LeeSpace.VISITED
+            priority = space.cost[key]
+            if astar: priority += heuristic(new,targets[side],vertical)
+            queue.put(priority,key)
 
     return False
 
@@ -97,80 +132,259 @@ def lee_route_components(cp1,cp2,layout,drc_cache,vertical=False):
 ######################################
 # PRIVATE FUNCTIONS
 
-class LeeEntry:
-    def __init__(self,point,cost,parent,change,jog,prev_jog,length,cpn):
-        self.point = point
-        self.material = point[2]
-        self.cost = cost
-        self.parent = parent
-        self.change = change
-        self.jog = jog
-        self.prev_jog = prev_jog # length of previous jog. used at end
-        self.length = length     # length of current path (same material)
-        self.area = self.get_area()
-        self.component = cpn # origin component
-                                       
-
-    def retrace(self):
-        """Given an entry, retrace back to origin. Return list of points
+# direction changes, stored as their position in the list
+CHANGES = [None,(-1,0,0),(1,0,0),(0,-1,0),(0,1,0),(0,0,-1),(0,0,1)]
+CHANGE_CODE = {change: code for code,change in enumerate(CHANGES)}
+
+class ChunkedArray:
+    """Array of a typecode, allocated in chunks on first write
+    Reads of unwritten chunks return default, so memory grows with the
+    indices actually used rather than the length
+    """
+    SHIFT = 12 # log2 of chunk length
+    LENGTH = 1 << SHIFT
+    MASK = LENGTH - 1
+
+    def __init__(self,typecode,default):
+        self.typecode, self.default = typecode, default
+        self.chunks = {}
+
+    def __getitem__(self,index):
+        chunk = self.chunks.get(index >> ChunkedArray.SHIFT)
+        if chunk is None:
+            return self.default
+        return chunk[index & ChunkedArray.MASK]
+
+    def __setitem__(self,index,value):
+        key = index >> ChunkedArray.SHIFT
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = array(self.typecode,[self.default]) * ChunkedArray.LENGTH
+            self.chunks[key] = chunk
+        chunk[index & ChunkedArray.MASK] = value
+
+class LeeSpace:
+    """Search state of the Lee router over a window
+    A state (x, y, layer, side) is packed into one integer index, where
+    side is 0 for states grown from cp1 and 1 for cp2. Visited flag, cost,
+    parent index, last change, jog lengths and path length are kept in
+    arrays indexed by state: preallocated for every state of small
+    windows, and chunked (allocated as states are reached) above
+    DENSE_STATES. Jogs and lengths only matter up to the design rule
+    thresholds, so they saturate at CAP.
+    """
+    UNVISITED, VISITED, BLOCKED = 0, 1, 2
+    CAP = 255
+    DENSE_STATES = 1 << 21 # largest number of states preallocated
+
+    def __init__(self,window):
+        self.x0, self.y0 = window.x, window.y
+        self.w, self.h = window.w, window.h
+        self.n_layers = len(dr.mat_layers)
+        self.side_size = self.n_layers * self.w * self.h
+        n = 2 * self.side_size
+        if n <= LeeSpace.DENSE_STATES:
+            table = lambda typecode,default: array(typecode,[default]) * n
+        else:
+            table = ChunkedArray
+        self.state = table('B',0)
+        self.cost = table('i',0)
+        self.parent = table('i',-1)
+        self.change = table('B',0)
+        self.jog = table('B',0)
+        self.prev_jog = table('B',0)
+        self.length = table('B',0)
+
+    def index(self,point,side):
+        """Returns the state index of point (x,y,mat) grown from side
+        """
+        layer = dr.layers_mat[point[2]]
+        return (((side * self.n_layers + layer) * self.h
+                 + point[1] - self.y0) * self.w + point[0] - self.x0)
+
+    def point(self,index):
+        """Returns point (x,y,mat) of state index
+        """
+        rest, x = divmod(index,self.w)
+        rest, y = divmod(rest,self.h)
+        layer = rest % self.n_layers
+        return (x + self.x0, y + self.y0, dr.mat_layers[layer])
+
+    def side(self,index):
+        """Returns side (0 for cp1, 1 for cp2) of state index
+        """
+        return index // self.side_size
+
+    def other(self,index):
+        """Returns index of the same point grown from the other side
+        """
+        if index >= self.side_size:
+            return index - self.side_size
+        return index + self.side_size
+
+    def start(self,index):
+        """Mark index as a starting point
         """
-        if self.parent is None:
-            return [self.point]
+        self.state[index] = LeeSpace.VISITED
+        self.jog[index], self.prev_jog[index] = 1, 0
+        self.length[index] = 1
+
+    def extend(self,index,parent,change,mat,vertical):
+        """Fill in cost, jogs and length of index (of material mat)
+        reached from parent with change. Vertical waives contact cost
+        """
+        # Calculate cost
+        if change[2] == 0: # same material
+            cost = dr.material_cost[mat] * dr.material_width[mat]
+        elif vertical:     # material change cost waived
+            cost = 0
+        else:              # material change
+            cost = dr.material_cost[mat] * (dr.material_width[mat] ** 2)
+        self.cost[index] = self.cost[parent] + cost
+
+        # Calculate jogs
+        if CHANGES[self.change[parent]] == change: # continue straight
+            jog = min(self.jog[parent] + 1,LeeSpace.CAP)
+            prev_jog = self.prev_jog[parent]
+        elif change[2] == 0:      # turn but same material
+            jog, prev_jog = 1, self.jog[parent]
+        else:                     # new material
+            jog, prev_jog = 1, 0
+        self.jog[index], self.prev_jog[index] = jog, prev_jog
+
+        # Calculate length of same material path
+        if change[2] == 0:
+            self.length[index] = min(self.length[parent] + 1,LeeSpace.CAP)
         else:
-            return self.parent.retrace() + [self.point]
+            self.length[index] = 1
 
-    def get_area(self):
-        width = dr.material_width[self.material]
-        return (self.length + width - 1) * width
+        self.change[index] = CHANGE_CODE[change]
+        self.parent[index] = parent
 
-def get_starting_points(components,visited):
-    """Generates starting points from each component and add to visited dict
+    def area(self,index,mat):
+        """Returns area of the same material path ending at index
+        """
+        width = dr.material_width[mat]
+        return (self.length[index] + width - 1) * width
+
+    def walk(self,index):
+        """Generator of points following parents from index to origin
+        """
+        while index != -1:
+            yield self.point(index)
+            index = self.parent[index]
+
+    def retrace(self,index):
+        """Returns list of points from origin to index
+        """
+        points = list(self.walk(index))
+        points.reverse()
+        return points
+
+def get_starting_points(components,space,window):
+    """Marks every point of each component line in space, so a path from
+    the other side is matched wherever it meets the component.
+    Returns a list of starting points (frontier points) per component and
+    a list of the marked points per component
     """
-    starting_points = {}
-    for c in components: # iterate through components
-        starting_points[c] = []
+    starting_points, lines = [], []
+    for side,c in enumerate(components): # iterate through components
+        line = []
         for p in c.line: # iterate through points in component
             if p[2] not in dr.routing_materials: continue # non-routing material
-            visited[(p,c)] = LeeEntry(p,0,None,None,1,0,1,c)
-            starting_points[c].append(p)
-    return starting_points
+            if not window.is_in(p): continue # outside the layout
+            space.start(space.index(p,side))
+            line.append(p)
+        lines.append(line)
+        # only the frontier is expanded. Own line points are visited, so a
+        # path cannot run along a segment to leave it: take all its points
+        starting_points.append([p for p in c.frontier(step=1)
+                                if p[2] in dr.routing_materials and
+                                window.is_in(p)])
+    return starting_points, lines
+
+def get_window(cp1,cp2,margin,bounds):
+    """Returns bounding box of cp1 and cp2 expanded by margin and clipped
+    to rect bounds (as rect). None if empty
+    """
+    points = [p for c in [cp1,cp2] for p in c.line]
+    if len(points) == 0:
+        return None
+    x0 = max(min(p[0] for p in points) - margin,bounds.x)
+    x1 = min(max(p[0] for p in points) + margin,bounds.x1)
+    y0 = max(min(p[1] for p in points) - margin,bounds.y)
+    y1 = min(max(p[1] for p in points) + margin,bounds.y1)
+    if x0 > x1 or y0 > y1:
+        return None
+    return ds.Rect(x0,y0,x1 - x0 + 1,y1 - y0 + 1,None,points=False)
+
+def same_area(a,b):
+    """Returns True if rects a and b cover the same area
+    """
+    return (a.x,a.y,a.w,a.h) == (b.x,b.y,b.w,b.h)
 
-def get_changes(vertex,info):
+def get_target(points):
+    """Returns bounding box (x0,y0,x1,y1) and set of layers of points
+    """
+    if len(points) == 0:
+        return None
+    xs, ys = [p[0] for p in points], [p[1] for p in points]
+    layers = set(dr.layers_mat[p[2]] for p in points)
+    return (min(xs),min(ys),max(xs),max(ys)), layers
+
+def heuristic(vertex,target,vertical):
+    """Returns a lower bound on the cost from vertex to the target:
+    manhattan distance to its bounding box at the cheapest cost per lambda,
+    plus the cheapest cost of each layer change needed to reach its layers
+    """
+    if target is None:
+        return 0
+    (x0,y0,x1,y1), layers = target
+    dx = max(x0 - vertex[0], 0, vertex[0] - x1)
+    dy = max(y0 - vertex[1], 0, vertex[1] - y1)
+    h = (dx + dy) * MIN_STEP_COST
+    if not vertical: # layer changes are free when elevating
+        layer = dr.layers_mat[vertex[2]]
+        h += min(abs(layer - l) for l in layers) * MIN_LAYER_COST
+    return h
+
+def get_changes(vertex,space,index):
     """Give all the possible direction changes for given point
     """
     # get material
-    mat = info.material
+    mat = vertex[2]
     layer = dr.layers_mat[mat]
+    last = CHANGES[space.change[index]]
 
     # contact keep shifting layer
     if mat not in dr.material_directions and mat in dr.contact_materials:
-        return [info.change]
+        return [last]
 
     # get turn options
     turn = dr.material_directions[mat]
     min_jog = dr.point_to_edge[mat]
-    turnable = (info.jog >= min_jog or info.prev_jog >= min_jog or
-                info.change is None)
-    layer_change = info.area >= dr.min_area[mat]
+    turnable = (space.jog[index] >= min_jog or
+                space.prev_jog[index] >= min_jog or last is None)
+    layer_change = space.area(index,mat) >= dr.min_area[mat]
         
     # possible changes for each direction
     dx,dy,dz = [(-1,0,0),(1,0,0)],[(0,-1,0),(0,1,0)],[(0,0,-1),(0,0,1)]
 
     changes = []
-    if info.change in dz: # just had layer change can go any direction
+    if last in dz: # just had layer change can go any direction
         if 'x' in turn:
             changes += dx
         if 'y' in turn:
             changes += dy
     else:
         # continue in same direction
-        if info.change is not None:
-            changes.append(info.change)
+        if last is not None:
+            changes.append(last)
         
         # turns if possible
-        if 'x' in turn and info.change not in dx and turnable:
+        if 'x' in turn and last not in dx and turnable:
             changes += dx
-        if 'y' in turn and info.change not in dy and turnable:
+        if 'y' in turn and last not in dy and turnable:
             changes += dy
         
         # layer change if possible
@@ -182,73 +396,44 @@ def get_changes(vertex,info):
 
     return changes
 
-def get_mat(info,change):
+def get_mat(mat,change):
     """Returns the new material. False if invalid
     """
-    layer = dr.layers_mat[info.material]
+    layer = dr.layers_mat[mat]
     new_layer = layer + change[2]
     try:
         return dr.mat_layers[new_layer]
     except KeyError:
         return False
-    
-def get_info(info,change,new,vertical):
-    """Returns a new LeeEntry for new point
-    """
 
-    # Calculate cost
-    if change[2] == 0: # same material
-        cost = dr.material_cost[new[2]] * dr.material_width[new[2]]
-    elif vertical:     # material change cost waived
-        cost = 0
-    else:              # material change
-        cost = dr.material_cost[new[2]] * (dr.material_width[new[2]] ** 2)
-    cost += info.cost
-
-    # Calculate jogs
-    if change == info.change: # continue straight
-        jog, prev_jog = info.jog + 1, info.prev_jog
-    elif change[2] == 0:      # turn but same material
-        jog, prev_jog = 1, info.jog
-    else:                     # new material
-        jog, prev_jog = 1, 0
-
-    # Calculate length of same material path
-    length = info.length + 1 if change[2] == 0 else 1
-        
-    return LeeEntry(new,cost,info,change,jog,prev_jog,
-                    length,info.component)
-
-def find_match(new,new_info,visited,components):
-    """Returns True if a valid path is found
+def find_match(new,index,space):
+    """Returns index of the other side at new if a valid path is found,
+    None otherwise
     """
-    mat = new_info.material
+    mat = new[2]
     # cannot connect on contact
     if mat not in dr.routing_materials:
-        return False
+        return None
     
     min_jog = dr.point_to_edge[mat]
 
-    # find match with other components
-    for c in components:
-        if c == new_info.component: continue        
-        key = (new,c)
-        if key in visited:
-            info = visited[key]
-            if not info: return False
-            changes = set([info.change,new_info.change])
-            dx,dy = set([(1,0,0),(-1,0,0)]),set([(0,1,0),(0,-1,0)])            
-            if changes == dx or changes == dy: # same direction
-                if info.jog + new_info.jog >= min_jog:
-                    return key
-            else: # different direction
-                min_jog = dr.point_to_edge[new[2]]
-                if info.jog >= min_jog or new_info.jog >= min_jog:
-                    return key
+    # find match with other component
+    other = space.other(index)
+    if space.state[other] != LeeSpace.VISITED: return None
+    changes = set([CHANGES[space.change[other]],CHANGES[space.change[index]]])
+    dx,dy = set([(1,0,0),(-1,0,0)]),set([(0,1,0),(0,-1,0)])            
+    if changes == dx or changes == dy: # same direction
+        if space.jog[other] + space.jog[index] >= min_jog:
+            return other
+    else: # different direction
+        min_jog = dr.point_to_edge[new[2]]
+        if space.jog[other] >= min_jog or space.jog[index] >= min_jog:
+            return other
                 
-    return False
+    return None
 
 def print_status(cost,start_time):
+    if not aux.Progress.due(): return
     # determine color
     elapsed = time.time() - start_time
     if elapsed > TIMEOUT * 0.98: color = 'FAIL'
@@ -257,7 +442,7 @@ def print_status(cost,start_time):
 
     # print
     elapsed_time = "{:.2f}s".format(elapsed)
-    print("   LEE: Cost {:4d} | Time {}".
+    aux.Progress.message("   LEE: Cost {:4d} | Time {}".
           format(cost,aux.color_format(elapsed_time,color)),
           end="\r")
     
@@ -5,6 +5,8 @@
 import data_structures as ds
 import auxiliary as aux
 
+from bisect import bisect_left, insort
+
 #####
 # NET ORDERING
 
@@ -39,15 +41,8 @@ def net_rule3(layout):
     # find number of pins from other nets inside mbb of given net
     pins_inside = {}
     for l in layout.labels:
-        pins_inside[l] = 0
         mbb_rect = get_mbb_rect(l,layout)
-
-        # find pins inside the mbb
-        for l2 in layout.labels:
-            if l == l2: continue # skip current net
-            for n in layout.nodes[l2]:
-                if mbb_rect.overlaps(n):
-                    pins_inside[l] += 1
+        pins_inside[l] = layout.pin_index.count(mbb_rect,exclude=l)
                     
     # sort by increasing number of pins and return
     return [net for net in sorted(pins_inside, key=pins_inside.get)]
@@ -110,34 +105,83 @@ def pair_rule3(layout,ordering_cache,count_same_net=True):
                     pairs.append((cp1,cp2))
         return pairs
 
-    def get_mbb(pair):
-        """Returns manhattan bounding box of the pair as a Rect
-        """
-        cp1, cp2 = pair
-        x0, x1 = min(cp1.x0,cp2.x0), max(cp1.x1,cp2.x1)
-        y0, y1 = min(cp1.y0,cp2.y0), max(cp1.y1,cp2.y1)
-        return ds.Rect(x0,y0,x1-x0,y1-y0,None)
-        
-    
-    def pins_inside(pair,layout):
-        """Returns number of pins inside the mbb created by the pair
-        """
-        if pair in ordering_cache:
-            return ordering_cache[pair]
-        
-        mbb = get_mbb(pair)
-        n_pins = 0
+    return sorted(get_pairs(layout),
+                  key=lambda pair: pins_inside(pair,layout,ordering_cache,
+                                               count_same_net))
+
+def get_mbb(pair):
+    """Returns manhattan bounding box of the pair as a Rect
+    """
+    cp1, cp2 = pair
+    x0, x1 = min(cp1.x0,cp2.x0), max(cp1.x1,cp2.x1)
+    y0, y1 = min(cp1.y0,cp2.y0), max(cp1.y1,cp2.y1)
+    return ds.Rect(x0,y0,x1-x0,y1-y0,None)
+
+def pins_inside(pair,layout,ordering_cache,count_same_net=True):
+    """Returns number of pins inside the mbb created by the pair
+    """
+    if pair in ordering_cache:
+        return ordering_cache[pair]
+
+    # count pins inside, skipping same net if required
+    exclude = None if count_same_net else pair[0].label
+    n_pins = layout.pin_index.count(get_mbb(pair),exclude=exclude)
+
+    ordering_cache[pair] = n_pins
+    return n_pins
+
+class PairQueue:
+    """pair_rule3 order kept up to date as components are added/removed,
+    so only pairs involving changed components are (re)sorted.
+    Ties are broken as in pair_rule3: by net, then by position of the
+    components in layout.components (i.e. order in which they were added)
+    """
+    def __init__(self,layout,ordering_cache,count_same_net=True):
+        self.layout = layout
+        self.ordering_cache = ordering_cache
+        self.count_same_net = count_same_net
+        self.net_index = {net: i for i,net in enumerate(layout.labels)}
+        self.entries = []   # sorted (pins, net, seq1, seq2, pair)
+        self.seq = {}       # component -> insertion number
+        self.pairs = {}     # component -> entries involving it
+        self.count = 0
         for net in layout.labels:
-            # skip same nets
-            if not count_same_net and net == pair[0].label: continue
+            for component in layout.components[net]:
+                self.add_component(component)
 
-            # count number of pins inside
-            for n in layout.nodes[net]:
-                if mbb.overlaps(n):
-                    n_pins += 1
+    def __len__(self):
+        return len(self.entries)
 
-        ordering_cache[pair] = n_pins
-        return n_pins
+    def __getitem__(self,i):
+        if isinstance(i,slice):
+            return [entry[-1] for entry in self.entries[i]]
+        return self.entries[i][-1]
 
-    return sorted(get_pairs(layout), key=lambda pair: pins_inside(pair,layout))
-    
+    def add_component(self,component):
+        """Add pairs of component with all other components of its net.
+        Component must already be in layout.components
+        """
+        self.seq[component] = self.count
+        self.count += 1
+        self.pairs[component] = []
+        net = component.label
+        for other in self.layout.components[net]:
+            if other is component or other not in self.seq:
+                continue
+            pair = (other,component)
+            pins = pins_inside(pair,self.layout,self.ordering_cache,
+                               self.count_same_net)
+            entry = (pins,self.net_index[net],self.seq[other],
+                     self.seq[component],pair)
+            insort(self.entries,entry)
+            self.pairs[component].append(entry)
+            self.pairs[other].append(entry)
+
+    def remove_component(self,component):
+        """Remove all pairs involving component
+        """
+        for entry in self.pairs.pop(component):
+            del self.entries[bisect_left(self.entries,entry)]
+            other = entry[-1][0] if entry[-1][1] is component else entry[-1][1]
+            self.pairs[other].remove(entry)
+        del self.seq[component]
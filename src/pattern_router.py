@@ -7,6 +7,9 @@ import auxiliary as aux
 import data_structures as ds
 import design_rule_checker as drc
 import pprint as pprint
+import heapq
+import telemetry
+from collections import defaultdict
 
 
 TERMINATE = 50000
@@ -21,16 +24,17 @@ def pattern_route_components(cp1,cp2,layout,drc_cache,elevate=True):
         hl1,hl2 = cp1.line_materials()[-1], cp2.line_materials()[-1]
         # elevate a component if needed
         if hl1 < hl2:
-            print("  Elevating")
+            aux.Progress.message("  Elevating")
             cp1.elevate(dr.mat_layers[hl2],layout)
         if hl2 < hl1:
-            print("  Elevating")
+            aux.Progress.message("  Elevating")
             cp2.elevate(dr.mat_layers[hl1],layout)
 
     
     for i,route in enumerate(generate_routes(cp1,cp2)):
         print_status(i,route.cost)
         if i > TERMINATE: break
+        telemetry.counts['pattern_candidates'] += 1
         drc_status = drc.check_route(route,cp1.label,layout,drc_cache,[cp1,cp2])
         if not drc_status: # conflict with existing layout
             continue
@@ -54,42 +58,68 @@ def generate_routes(cp1,cp2,lazy=False):
     in increasing cost. Lazy True attempts to yield one by one in heuristic
     order. Lazy False will return by increasing cost.
     """
-    def mat_cost(p):
-        """Returns cost of material cost in a given pair p
+    def mat_cost(mat1,mat2):
+        """Returns cost of material cost for a pair of materials
         """
-        p1,p2 = p[0],p[1]
-        mat1,mat2 = p1[2],p2[2]
         estimate = ((dr.material_cost[mat1] + dr.material_cost[mat2]) / 2)
         contact = dr.get_contact([mat1,mat2])
         if mat1 != mat2 and contact is not None:
             estimate += dr.material_cost[contact] * dr.material_width[contact]
         return estimate
         
-    def get_pair_distance(cp1,cp2):
-        """Returns a sorted list of point pairs between cp1 and cp2.
-        Sorted by increasing manhattan distance
-        """        
-        pair_distance = {}
-        for p1 in cp1.line:
-            if p1[2] not in dr.routing_materials: continue        
-            for p2 in cp2.line:
-                if p2[2] not in dr.routing_materials: continue
-                pair_distance[(p1,p2)] = aux.manhattan_distance(p1,p2)
-        key = lambda p: pair_distance[p] * mat_cost(p)
-        pairs = [k for k in sorted(pair_distance,key=key)]
-        return pairs, pair_distance
-
-    pairs, pair_distance = get_pair_distance(cp1,cp2)
+    def get_pairs(points1,points2):
+        """Generator of ((p1,p2),distance) for pairs of points1 and points2
+        in nondecreasing manhattan distance weighted by material cost.
+        Each p1 starts in a heap keyed by a lower bound (distance to the
+        bounding box of the points2 of a material). Only when it reaches
+        the top are those points sorted by distance to p1, so the first
+        pairs come out without building the full cross product.
+        """
+        groups = defaultdict(list) # points2 by material
+        for p in points2:
+            groups[p[2]].append(p)
+        boxes = {m: (min(p[0] for p in ps),min(p[1] for p in ps),
+                     max(p[0] for p in ps),max(p[1] for p in ps))
+                 for m,ps in groups.items()}
+        weights = {}
+
+        heap = []
+        for p1 in points1:
+            for m2,(x0,y0,x1,y1) in boxes.items():
+                pair_mats = (p1[2],m2)
+                if pair_mats not in weights:
+                    weights[pair_mats] = mat_cost(p1[2],m2)
+                bound = (max(x0 - p1[0],0,p1[0] - x1) +
+                         max(y0 - p1[1],0,p1[1] - y1))
+                heap.append((bound * weights[pair_mats],len(heap),
+                             p1,m2,0,None))
+        heapq.heapify(heap)
+        seq = len(heap)
+
+        while len(heap) > 0:
+            key,_,p1,m2,i,ordered = heapq.heappop(heap)
+            if ordered is None: # lower bound entry: sort points of m2
+                ordered = sorted(groups[m2],
+                                 key=lambda p2: aux.manhattan_distance(p1,p2))
+            else:
+                yield (p1,ordered[i]), aux.manhattan_distance(p1,ordered[i])
+                i += 1
+            if i < len(ordered):
+                dist = aux.manhattan_distance(p1,ordered[i])
+                seq += 1
+                heapq.heappush(heap,(dist * weights[(p1[2],m2)],seq,
+                                     p1,m2,i,ordered))
+
+    points1 = [p for p in cp1.frontier() if p[2] in dr.routing_materials]
+    points2 = [p for p in cp2.frontier() if p[2] in dr.routing_materials]
     route_pq = ds.SPQ()
 
-    # print(len(pairs))
-    if len(pairs) > LAZY_THRESHOLD:
+    if len(points1) * len(points2) > LAZY_THRESHOLD:
         lazy = True
         
     detour_dist,detouring = 0, []
-    for p in pairs:
+    for p,current_dist in get_pairs(points1,points2):
         # generate and return all possible detours first
-        current_dist = pair_distance[p]
         for dt in range(detour_dist,current_dist):
             for d_pair in detouring:
                 d_pair[2] += 1 # increase detour amount
@@ -212,8 +242,8 @@ def incident(s,d):
         return [[add_width(s,width),add_width(d,width)]]
     elif (s[0],s[1]) == (d[0],d[1]): # same position, different material
         contact = dr.get_contact([s[2],d[2]])
-        width = dr.material_width[contact]
         if contact: # valid contact
+            width = dr.material_width[contact]
             return [[
                 add_width(s,width),
                 (s[0],s[1],contact,width),
@@ -471,6 +501,7 @@ def add_width(point,width):
 # PRINT
 
 def print_status(it,cost):
+    if not aux.Progress.due(): return
     # determine color
     if it > TERMINATE: color = 'FAIL'
     elif it > TERMINATE / 2: color = 'WARNING'
@@ -480,7 +511,7 @@ def print_status(it,cost):
     iteration = "{}".format(it+1)
 
     # print
-    print(
+    aux.Progress.message(
         "   PATTERN: Cost {} | Route {}"
         .format(cost,aux.color_format(it,color)),
         end='\r'
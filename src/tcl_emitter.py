@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Streaming TCL emitter for Magic
+
+Rects are collected per material and net. On flush, the rects of each
+(material, net) are merged with Rect.make_rects (when that gives fewer) and
+painted material by material (in layer order) so Magic switches layers
+as few times as possible. Output goes through a large write buffer.
+"""
+
+import data_structures as ds
+import design_rules as dr
+
+from collections import defaultdict
+
+BUFFER = 1 << 20 # write buffer size (bytes)
+
+class Emitter:
+    """Collects rects and cells and writes them as TCL on flush
+    """
+    def __init__(self,fp):
+        self.fp = fp
+        self.shapes = defaultdict(lambda: defaultdict(list)) # mat -> net
+        self.labels = {} # labeled contacts (ordered set)
+
+    def open(filename):
+        """Returns an emitter writing to filename with a large buffer
+        """
+        return Emitter(open(filename,'w',buffering=BUFFER))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.flush()
+        self.fp.close()
+
+    def add_cell(self,cell):
+        """Cells are placed directly
+        """
+        cell.emit_tcl(self.fp)
+
+    def add_rect(self,rect):
+        """Add rect to be painted
+        """
+        self.shapes[rect.m][rect.l].append(rect)
+        if rect.l is not None and rect.m[-1] == 'c':
+            self.labels[rect] = True
+
+    def add_component(self,component):
+        """Add segments and fillers of component
+        """
+        for segment in component.segments:
+            self.add_rect(ds.make_segment_rect(segment[0],segment[1],
+                                               component.label))
+        for k,f in component.fillers.items():
+            self.add_rect(f)
+
+    def flush(self):
+        """Paint merged rects by material, then labels
+        """
+        write = self.fp.write
+        order = lambda m: (dr.layers_mat.get(m,len(dr.layers_mat)),m)
+        for mat in sorted(self.shapes,key=order):
+            nets = self.shapes[mat]
+            for net in sorted(nets,key=str):
+                rects = nets[net]
+                if len(rects) > 1:
+                    points = set()
+                    for rect in rects:
+                        points.update(rect.get_points())
+                    merged = ds.Rect.make_rects(points,mat)
+                    # overlapping rects may split into more when merged
+                    if len(merged) < len(rects):
+                        rects = merged
+                for r in rects:
+                    write("box {} {} {} {}\npaint {}\n".
+                          format(r.x,r.y,r.x + r.w,r.y + r.h,mat))
+                    # label while the box is still on an unmerged contact
+                    if r in self.labels:
+                        del self.labels[r]
+                        self.write_label(r)
+        for rect in self.labels:
+            write("box {} {} {} {}\n".format(rect.x,rect.y,
+                                             rect.x + rect.w,rect.y + rect.h))
+            self.write_label(rect)
+        self.shapes.clear()
+        self.labels = {}
+
+    def write_label(self,rect):
+        """Label rect, with the box currently on rect
+        """
+        self.fp.write("move right 1\nmove up 1\nbox w 0\nbox h 0\nlabel {}\n"
+                      .format(rect.l))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Per pair routing telemetry
+
+Routers and the DRC bump the running counters in counts. PairLog takes
+the difference over each routing attempt and writes one record per pair
+as JSON lines (or CSV if the filename ends with .csv).
+"""
+
+import csv
+import json
+import time
+from collections import defaultdict
+
+# running counters (lee_expansions, pattern_candidates, drc_calls)
+counts = defaultdict(int)
+
+FIELDS = ['pair','net','router','success','prefetched',
+          'lee_expansions','pattern_candidates','drc_calls',
+          'drc_cache_hits','drc_cache_misses','drc_cache_hit_rate',
+          'ripups','time']
+
+class PairLog:
+    """Writes a record per routed pair. With no filename, nothing is written
+    """
+    def __init__(self,filename=None):
+        self.fp, self.writer = None, None
+        self.n = 0
+        if filename is None:
+            return
+        self.fp = open(filename,'w',newline='')
+        if filename.endswith('.csv'):
+            self.writer = csv.DictWriter(self.fp,fieldnames=FIELDS)
+            self.writer.writeheader()
+
+    def start(self,drc_cache):
+        """Mark start of an attempt
+        """
+        self.counts = dict(counts)
+        self.cache = (drc_cache.hits,drc_cache.misses)
+        self.start_time = time.time()
+
+    def record(self,drc_cache,**fields):
+        """Write record of attempt started with start. fields gives net,
+        router, success, prefetched and ripups
+        """
+        if self.fp is None:
+            return
+        record = {'pair': self.n}
+        record.update(fields)
+        for name in ['lee_expansions','pattern_candidates','drc_calls']:
+            record[name] = counts[name] - self.counts.get(name,0)
+        hits = drc_cache.hits - self.cache[0]
+        misses = drc_cache.misses - self.cache[1]
+        record['drc_cache_hits'], record['drc_cache_misses'] = hits, misses
+        record['drc_cache_hit_rate'] = (round(hits / (hits + misses),4)
+                                        if hits + misses > 0 else None)
+        record['time'] = round(time.time() - self.start_time,6)
+        self.n += 1
+
+        if self.writer is not None:
+            self.writer.writerow(record)
+        else:
+            self.fp.write(json.dumps(record) + "\n")
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
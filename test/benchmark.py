@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+'''
+benchmark.py
+
+usage: ./benchmark.py run results.json [quick]
+       ./benchmark.py compare old.json new.json
+
+runs a seeded matrix of generated problems (and the placed test/layout)
+through each routing mode REPEATS times and records wall time (fastest and
+all runs), peak memory, routed/total pairs, rip-ups and total route cost.
+compare reports differences between two results files and exits with 1 if
+anything regressed
+'''
+
+import sys
+import os
+import json
+import time
+import contextlib
+import queue
+import resource
+import multiprocessing
+from itertools import product
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(TEST_DIR,'../src'))
+import gen_problems
+import auxiliary as aux
+import controller
+from layout import Layout
+
+# problem matrix
+DIMS = [60,120]
+NODES = [16,32]
+NETS = [6,12]
+MATERIALS = [['ndc','m3','m4'],['m1','m2']]
+SEEDS = [100]
+MODES = ['pl','l']
+PLACED = True          # include test/layout
+QUICK = [(60,16,6,0,100)] # (dim,nodes,nets,materials index,seed)
+
+CASE_TIMEOUT = 1800    # seconds per run
+POLL_INTERVAL = 1      # seconds between checks that the run is still alive
+REPEATS = 3            # runs per case and mode (fastest is compared)
+TIME_TOLERANCE = 0.25  # relative slowdown reported as regression, widened
+                       # to the spread between repeats when that is larger
+
+def get_cases(quick=False):
+    """Returns list of (name, inputs) for each problem
+    """
+    matrix = (QUICK if quick else
+              product(DIMS,NODES,NETS,range(len(MATERIALS)),SEEDS))
+    cases = []
+    for dim,n_nodes,n_nets,mats,seed in matrix:
+        name = "gen-d{}-n{}-k{}-m{}-s{}".format(dim,n_nodes,n_nets,
+                                               '+'.join(MATERIALS[mats]),seed)
+        inputs = {
+            'layers': 12,
+            'input_mode': 'explicit',
+            'generate': (n_nodes,n_nets,dim,MATERIALS[mats],seed),
+        }
+        cases.append((name,inputs))
+    if PLACED and not quick:
+        layout_dir = os.path.join(TEST_DIR,'layout/')
+        cases.append(('placed-test-layout',{
+            'layers': 12,
+            'input_mode': 'placed',
+            'cell_dir' : os.path.join(TEST_DIR,'cells/'),
+            'nodefile' : layout_dir + 'layout.nodes',
+            'netfile'  : layout_dir + 'layout.nets',
+            'placefile': layout_dir + 'layout.pl',
+        }))
+    return cases
+
+def run_case(inputs,mode,results):
+    """Route one case in this (child) process and put record on results
+    """
+    aux.Progress.level = aux.Progress.SILENT
+    inputs = dict(inputs,order='pair_rule3',route_modes=mode)
+    if 'generate' in inputs:
+        n_nodes,n_nets,dim,materials,seed = inputs.pop('generate')
+        gen_problems.MAT = materials
+        with open(os.devnull,'w') as devnull, \
+             contextlib.redirect_stdout(devnull):
+            inputs['rects'] = gen_problems.generate_case(
+                n_nodes,n_nets,x_max=dim,y_max=dim,seed=seed)
+
+    start = time.time()
+    layout = Layout(inputs)
+    stats = controller.lafrieda(layout,inputs)
+    record = {
+        'time': time.time() - start,
+        'peak_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'routed': stats['routed'],
+        'total': stats['total'],
+        'ripups': stats['ripups'],
+        'cost': stats['cost'],
+    }
+    results.put(record)
+
+def run_once(inputs,mode):
+    """Route one case in a fresh child process. Returns (status, record)
+    """
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    proc = ctx.Process(target=run_case,args=(inputs,mode,results))
+    proc.start()
+    status, record = 'timeout', None
+    deadline = time.time() + CASE_TIMEOUT
+    while time.time() < deadline:
+        # a child gone before waiting has posted everything it will post
+        exited = not proc.is_alive()
+        try:
+            record = results.get(timeout=POLL_INTERVAL)
+            status = 'ok'
+            break
+        except queue.Empty:
+            if exited:
+                status = 'error'
+                break
+    proc.terminate()
+    proc.join()
+    return status, record
+
+def run(filename,quick=False):
+    """Run every case in every mode REPEATS times and write records to
+    filename. time is the fastest run, times has every run
+    """
+    records = []
+    for name,inputs in get_cases(quick):
+        for mode in MODES:
+            print("{} [{}] ".format(name,mode),end='',flush=True)
+            record = {'case': name,'mode': mode,'status': 'ok','times': []}
+            for _ in range(REPEATS):
+                status, result = run_once(inputs,mode)
+                if status != 'ok':
+                    record = {'case': name,'mode': mode,'status': status}
+                    break
+                record['times'].append(result.pop('time'))
+                peak_mb = max(result.pop('peak_mb'),record.get('peak_mb',0))
+                record.update(result,peak_mb=peak_mb)
+            if record['status'] == 'ok':
+                record['time'] = min(record['times'])
+            records.append(record)
+            print(record['status'],
+                  ' '.join("{:.2f}s".format(t) for t in record['times'])
+                  if 'times' in record else '')
+
+    with open(filename,'w') as f:
+        json.dump({'python': sys.version.split()[0],'records': records},
+                  f,indent=2)
+
+def compare(old_file,new_file):
+    """Print per run differences. Returns True if anything regressed
+    """
+    with open(old_file) as f:
+        old = {(r['case'],r['mode']): r for r in json.load(f)['records']}
+    with open(new_file) as f:
+        new = {(r['case'],r['mode']): r for r in json.load(f)['records']}
+
+    regressed = False
+    print("{:<40}{:>6}{:>18}{:>16}{:>18}{:>14}".format(
+        'case','mode','time (s)','peak (MB)','routed','cost'))
+    for key in sorted(set(old) | set(new)):
+        if key not in old or key not in new:
+            print("{:<40}{:>6}  only in {}".format(
+                key[0],key[1],old_file if key in old else new_file))
+            continue
+        a, b = old[key], new[key]
+        if a['status'] != 'ok' or b['status'] != 'ok':
+            print("{:<40}{:>6}  {} -> {}".format(key[0],key[1],
+                                                 a['status'],b['status']))
+            regressed |= a['status'] == 'ok'
+            continue
+
+        flags = []
+        tolerance = max([TIME_TOLERANCE,spread(a),spread(b)])
+        if b['time'] > a['time'] * (1 + tolerance): flags.append('time')
+        if b['routed'] < a['routed']: flags.append('routed')
+        if b['routed'] == a['routed'] and b['cost'] > a['cost']:
+            flags.append('cost')
+        regressed |= len(flags) > 0
+
+        print("{:<40}{:>6}{:>8.2f} ->{:>7.2f}{:>7.0f} ->{:>6.0f}"
+              "{:>5}/{} ->{:>4}/{}{:>7} ->{:>6}  {}".format(
+                  key[0],key[1],a['time'],b['time'],a['peak_mb'],b['peak_mb'],
+                  a['routed'],a['total'],b['routed'],b['total'],
+                  a['cost'],b['cost'],
+                  aux.color_format(' '.join(flags),'FAIL') if flags else ''))
+    return regressed
+
+def spread(record):
+    """Returns relative spread (slowest / fastest - 1) of the repeats
+    """
+    times = record.get('times',[record['time']])
+    return max(times) / min(times) - 1 if min(times) > 0 else 0
+
+
+if __name__ == '__main__':
+    # set ordering depends on string hashing, so fix the seed for repeatable
+    # routes (re-run with it set)
+    if os.environ.get('PYTHONHASHSEED') is None:
+        os.environ['PYTHONHASHSEED'] = '0'
+        os.execv(sys.executable,[sys.executable] + sys.argv)
+
+    if len(sys.argv) >= 3 and sys.argv[1] == 'run':
+        run(sys.argv[2],quick=len(sys.argv) > 3 and sys.argv[3] == 'quick')
+    elif len(sys.argv) == 4 and sys.argv[1] == 'compare':
+        sys.exit(1 if compare(sys.argv[2],sys.argv[3]) else 0)
+    else:
+        print("usage: ./benchmark.py run results.json [quick]\n"
+              "       ./benchmark.py compare old.json new.json")
+        sys.exit(1)
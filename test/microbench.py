@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+'''
+microbench.py
+
+usage: ./microbench.py [kernel ...]
+
+micro-benchmarks of the hot kernels: check_segment at increasing layout
+density, lee_route_window expansions, route_points per pattern,
+Route.from_points, Rect.make_rects, Component.join and SPQ. For each,
+reports ops/sec and, from a separate
+tracemalloc run, peak bytes above the starting point (the largest
+transient footprint of an op) and memory blocks still held afterwards
+'''
+
+import sys
+import os
+import time
+import random
+import tracemalloc
+import contextlib
+from itertools import cycle
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(TEST_DIR,'../src'))
+from gen_problems import generate_case
+import auxiliary as aux
+import data_structures as ds
+import design_rule_checker as drc
+import pattern_router as pr
+import lee_router
+import telemetry
+from layout import Layout
+
+MIN_TIME = 0.5    # seconds each kernel is timed for
+ALLOC_OPS = 200   # ops traced for allocations
+DENSITIES = [16,64,256] # nodes on a 200x200 layout
+LEE_NODES = 64    # nodes on the 200x200 layout routed by Lee
+
+def measure(name,op,n_ops=1):
+    """Time op() repeatedly for MIN_TIME then trace ALLOC_OPS calls.
+    n_ops is the number of operations one call of op performs
+    """
+    calls, start = 0, time.perf_counter()
+    while True:
+        op()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_TIME: break
+    ops_per_sec = calls * n_ops / elapsed
+
+    traced = max(1,min(ALLOC_OPS,calls))
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    if hasattr(tracemalloc,'reset_peak'): # 3.9+
+        tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    for _ in range(traced):
+        op()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    held = sum(stat.count_diff for stat in after.compare_to(before,'lineno'))
+
+    print("   {:<36}{:>14,.0f} ops/s{:>12,} B peak{:>8} blocks held"
+          .format(name,ops_per_sec,peak,held))
+
+#####
+# KERNELS
+
+def bench_check_segment():
+    print(aux.color_format("check_segment",'HEADER'))
+    for n_nodes in DENSITIES:
+        with open(os.devnull,'w') as devnull, \
+             contextlib.redirect_stdout(devnull):
+            rects = generate_case(n_nodes,n_nodes // 3,x_max=200,y_max=200,
+                                  seed=100)
+            layout = Layout({'layers': 12,'input_mode': 'explicit',
+                             'rects': rects})
+        random.seed(1)
+        segments = []
+        for _ in range(500):
+            x, y = random.randint(0,200), random.randint(0,200)
+            length = random.randint(0,40)
+            mat = random.choice(['m1','m2','m3'])
+            end = (x + length,y,mat) if random.random() < 0.5 else \
+                  (x,y + length,mat)
+            segments.append(((x,y,mat),end))
+        label = sorted(layout.labels)[0]
+        segs = cycle(segments)
+
+        def op():
+            A,B = next(segs)
+            drc.check_segment(A,B,label,layout,drc.Cache())
+        measure("{} nodes".format(n_nodes),op)
+
+def bench_lee():
+    print(aux.color_format("lee_route_window",'HEADER'))
+    with open(os.devnull,'w') as devnull, \
+         contextlib.redirect_stdout(devnull):
+        rects = generate_case(LEE_NODES,LEE_NODES // 3,x_max=200,y_max=200,
+                              seed=100)
+        layout = Layout({'layers': 12,'input_mode': 'explicit',
+                         'rects': rects})
+    # first two components of the first net that has two
+    label = next(l for l in sorted(layout.labels)
+                 if len(layout.components[l]) >= 2)
+    cp1, cp2 = layout.components[label][:2]
+    window = lee_router.get_window(cp1,cp2,lee_router.WINDOW_MARGIN,
+                                   layout.bounding_box)
+
+    def op(): # fresh DRC cache so each call expands the same way
+        lee_router.lee_route_window(cp1,cp2,layout,drc.Cache(),window,False,
+                                    lee_router.ASTAR,time.time())
+    telemetry.counts['lee_expansions'] = 0
+    op()
+    expansions = telemetry.counts['lee_expansions']
+    # ops/s here is expansions/s
+    measure("{}x{} window, {} expansions".format(window.w,window.h,
+                                                 expansions),
+            op,n_ops=expansions)
+
+def bench_route_points():
+    print(aux.color_format("route_points",'HEADER'))
+    cases = {
+        'O': ((10,10,'m1'),(10,10,'m2')),
+        'I': ((0,0,'m1'),(0,40,'m1')),
+        'L': ((0,0,'m1'),(40,30,'m2')),
+        'Z': ((0,0,'m1'),(40,30,'m1')),
+        'U': ((0,0,'m1'),(40,0,'m1')),
+    }
+    for pattern,(s,d) in cases.items():
+        measure("pattern {}".format(pattern),
+                lambda: pr.route_points(s,d,pattern,detour=10))
+
+def bench_from_points():
+    print(aux.color_format("Route.from_points",'HEADER'))
+    # staircase of 20 steps of 10 in m1/m2 with contacts at corners
+    points = []
+    x, y = 0, 0
+    for step in range(20):
+        for _ in range(10):
+            points.append((x,y,'m1'))
+            x += 1
+        points += [(x,y,'m1'),(x,y,'m2')]
+        for _ in range(10):
+            points.append((x,y,'m2'))
+            y += 1
+        points += [(x,y,'m2'),(x,y,'m1')]
+    measure("{} point staircase".format(len(points)),
+            lambda: ds.Route.from_points(iter(points)))
+
+def bench_make_rects():
+    print(aux.color_format("Rect.make_rects",'HEADER'))
+    random.seed(2)
+    blob = set()
+    for _ in range(20):
+        x, y = random.randint(0,60), random.randint(0,60)
+        blob.update((x + i,y + j) for i in range(random.randint(2,20))
+                    for j in range(random.randint(2,6)))
+    measure("{} point blob".format(len(blob)),
+            lambda: ds.Rect.make_rects(set(blob),'m1'))
+
+def bench_join():
+    print(aux.color_format("Component.join",'HEADER'))
+    cp1, cp2 = ds.Component('n'), ds.Component('n')
+    cp1.add_node(ds.Rect(0,0,4,4,'m1','n'))
+    cp2.add_node(ds.Rect(40,30,4,4,'m1','n'))
+    route = pr.route_points((0,0,'m1'),(40,30,'m1'),'L')[0]
+    measure("two nodes + L route",lambda: ds.Component.join(cp1,cp2,route))
+
+def bench_spq():
+    print(aux.color_format("SPQ",'HEADER'))
+    random.seed(3)
+    n = 10000
+    priorities = [random.randint(0,200) for _ in range(n)]
+
+    def op():
+        queue = ds.SPQ()
+        for i,p in enumerate(priorities):
+            queue.put(p,i)
+        while not queue.empty():
+            queue.get()
+    measure("{} puts + gets".format(n),op,n_ops=2 * n)
+
+KERNELS = {
+    'check_segment': bench_check_segment,
+    'lee': bench_lee,
+    'route_points': bench_route_points,
+    'from_points': bench_from_points,
+    'make_rects': bench_make_rects,
+    'join': bench_join,
+    'spq': bench_spq,
+}
+
+if __name__ == '__main__':
+    aux.Progress.level = aux.Progress.SILENT
+    names = sys.argv[1:] if len(sys.argv) > 1 else list(KERNELS)
+    for name in names:
+        if name not in KERNELS:
+            print("unknown kernel {} (choose from {})".
+                  format(name,', '.join(KERNELS)))
+            sys.exit(1)
+    for name in names:
+        KERNELS[name]()